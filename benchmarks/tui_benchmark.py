@@ -0,0 +1,333 @@
+"""Keystroke to paint latency benchmarks for the TUI grader.
+
+The real AddressBookApplication, RecordList and EditRecord are driven by scripted keys (npyscreen's
+TEST_SETTINGS['INPUT_GENERATOR']) against a curses stand-in which counts draw calls instead of drawing, over
+synthetic courses. From the repository root run:
+
+    python -m benchmarks.tui_benchmark -n 100 -n 10000 -w 1K -w 50M
+"""
+import curses
+import curses.ascii
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, namedtuple
+from typing import Callable, Iterable, List
+
+import click
+
+# Importing grading_lib opens (and truncates) log.log in the working directory, so import it from a scratch directory
+# to leave the caller's alone.
+_log_dir = tempfile.TemporaryDirectory(prefix="tui_benchmark.")
+_cwd = os.getcwd()
+os.chdir(_log_dir.name)
+try:
+    from grading_lib import npyscreen
+    from grading_lib.npyscreen import npyspmfuncs
+    from grading_lib.npyscreen.proto_fm_screen_area import ScreenArea
+    from grading_lib.question import AddressBookApplication, GradeDB, Question
+    from grading_lib.writeup import Priority, Writeup
+finally:
+    os.chdir(_cwd)
+
+DRAW_CALLS = ("addstr", "addnstr", "addch", "hline", "vline", "border")
+QUESTIONS = [Question("Style", 10, "Style issues"),
+             Question("Tests", 20, "Failing tests"),
+             Question("Writeup", 5, "Writeup is incomplete")]
+WORDS = ("assert", "expected", "got", "passed", "failed", "timeout", "output", "test", "case", "line", "return",
+         "value", "diff", "segfault", "malloc", "free", "NULL", "0x7ffd", "int", "char", "for", "while", "{", "}")
+
+
+class FakePad(object):
+    """Stands in for a curses pad or window, counting each call instead of drawing."""
+    def __init__(self, calls: Counter, lines, columns):
+        self.calls = calls
+        self.lines = lines
+        self.columns = columns
+
+    def getmaxyx(self):
+        return self.lines, self.columns
+
+    def getch(self):
+        return -1
+
+    def inch(self, *args):
+        return ord(" ")
+
+    def __getattr__(self, name):
+        calls = self.calls
+
+        def call(*args, **kwargs):
+            calls[name] += 1
+
+        # Cache the counter so later calls don't come through __getattr__ and skew the timings.
+        setattr(self, name, call)
+        return call
+
+
+class FakeCurses(object):
+    """Replaces the curses functions npyscreen uses with ones that count calls, for as long as it is entered.
+
+    The screen is always `lines` by `columns` and has no colours.
+    """
+    ACS = ("ACS_BLOCK", "ACS_BTEE", "ACS_HLINE", "ACS_LLCORNER", "ACS_LRCORNER", "ACS_LTEE", "ACS_RARROW",
+           "ACS_RTEE", "ACS_TTEE", "ACS_ULCORNER", "ACS_URCORNER", "ACS_VLINE")
+    NO_OPS = ("beep", "cbreak", "nocbreak", "echo", "noecho", "raw", "meta", "halfdelay", "curs_set", "flushinp",
+              "napms", "mousemask", "def_prog_mode", "reset_prog_mode", "use_default_colors", "start_color",
+              "init_pair", "init_color", "ungetch", "endwin")
+
+    def __init__(self, lines=30, columns=120):
+        self.lines = lines
+        self.columns = columns
+        self.calls = Counter()
+        self._saved = []  # (owner, name, original value or _MISSING)
+
+    def newpad(self, lines, columns):
+        return FakePad(self.calls, lines, columns)
+
+    def newwin(self, lines=0, columns=0, *args):
+        return FakePad(self.calls, lines or self.lines, columns or self.columns)
+
+    def doupdate(self):
+        self.calls["doupdate"] += 1
+
+    def _patch(self, owner, name, value):
+        self._saved.append((owner, name, owner.__dict__.get(name, _MISSING)))
+        setattr(owner, name, value)
+
+    def __enter__(self):
+        def no_op(*args, **kwargs):
+            pass
+
+        for name in self.NO_OPS:
+            self._patch(curses, name, no_op)
+        for i, name in enumerate(self.ACS):
+            self._patch(curses, name, ord("+") if i % 2 else ord("-"))
+        self._patch(curses, "COLOR_PAIRS", 256)
+        self._patch(curses, "has_colors", lambda: False)
+        self._patch(curses, "can_change_color", lambda: False)
+        self._patch(curses, "color_pair", lambda pair: 0)
+        self._patch(curses, "initscr", lambda: self.newwin())
+        self._patch(curses, "newpad", self.newpad)
+        self._patch(curses, "newwin", self.newwin)
+        self._patch(curses, "doupdate", self.doupdate)
+        # Forms size themselves with an ioctl on the terminal, which there may not be.
+        size = (self.lines - 1, self.columns - 1)
+        self._patch(ScreenArea, "_max_physical", lambda screen: size)
+        return self
+
+    def __exit__(self, *exc):
+        while self._saved:
+            owner, name, value = self._saved.pop()
+            if value is _MISSING:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, value)
+
+
+_MISSING = object()
+
+
+class KeyTiming(namedtuple("KeyTiming", ["key", "seconds", "calls"])):
+    @property
+    def draws(self):
+        return sum(self.calls[name] for name in DRAW_CALLS)
+
+
+class KeyScript(object):
+    """Feeds keys to npyscreen one at a time, timing each from when it is read until the next key is asked for.
+
+    By then the key has been handled, any events it caused have been processed and the screen has been updated.
+    Steps which are callables are run between keys without being timed, e.g. to wait for a background load.
+    """
+    def __init__(self, screen: FakeCurses, steps: Iterable):
+        self.screen = screen
+        self.steps = steps
+        self.started = time.perf_counter()
+        self.first_paint = None  # seconds from creating the script until the first key was asked for
+        self.timings = []  # type: List[KeyTiming]
+
+    def keys(self):
+        pending = None  # (key, start, calls before) of the key being handled
+        for step in self.steps:
+            now = time.perf_counter()
+            if pending is not None:
+                self._finish(pending, now)
+                pending = None
+            elif self.first_paint is None:
+                self.first_paint = now - self.started
+            if callable(step):
+                step()
+                continue
+            pending = (step, time.perf_counter(), self.screen.calls.copy())
+            yield step
+        if pending is not None:
+            self._finish(pending, time.perf_counter())
+
+    def _finish(self, pending, now):
+        key, start, before = pending
+        self.timings.append(KeyTiming(key, now - start, self.screen.calls - before))
+
+
+class BenchmarkResult(namedtuple("BenchmarkResult", ["scenario", "students", "writeup_bytes", "first_paint",
+                                                     "timings"])):
+    def latency(self, q) -> float:
+        """The `q` quantile of the per key latencies in seconds, interpolating between the closest ranks."""
+        seconds = sorted(t.seconds for t in self.timings)
+        if not seconds:
+            return 0.0
+        pos = q * (len(seconds) - 1)
+        lower, upper = int(pos), min(int(pos) + 1, len(seconds) - 1)
+        return seconds[lower] + (seconds[upper] - seconds[lower]) * (pos - lower)
+
+    @property
+    def mean_draws(self) -> float:
+        return sum(t.draws for t in self.timings) / max(len(self.timings), 1)
+
+    @property
+    def max_draws(self) -> int:
+        return max((t.draws for t in self.timings), default=0)
+
+    @property
+    def updates_per_key(self) -> float:
+        return sum(t.calls["doupdate"] for t in self.timings) / max(len(self.timings), 1)
+
+
+def synthetic_text(size, seed=0) -> str:
+    """About `size` bytes of test output like text, with the odd line long enough to wrap."""
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size:
+        i = len(lines)
+        line = "{:>6}: {}".format(i, " ".join(rng.choices(WORDS, k=rng.randint(2, 60 if i % 40 == 0 else 14))))
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+def make_course(root, students, writeup_bytes=1024, first_writeup_bytes=None, graded_every=3) -> GradeDB:
+    """Writes a synthetic course to `root` and loads it.
+
+    Args:
+        root: An empty directory to put the writeups and reviews in.
+        students: The number of students.
+        writeup_bytes: The size of each student's writeup.
+        first_writeup_bytes: The size of the first student's writeup, the one the list starts on, if different.
+        graded_every: Every n-th student already has a review with some points taken off.
+    """
+    writeup_dir = os.path.join(root, "writeups")
+    os.makedirs(writeup_dir)
+    names = ["s{:05}".format(i) for i in range(students)]
+    for i, name in enumerate(names):
+        size = first_writeup_bytes if i == 0 and first_writeup_bytes is not None else writeup_bytes
+        writeup = Writeup()
+        writeup.add_section("Summary", Priority.Top, "{} passed {} of 40 tests".format(name, i % 41), html="")
+        writeup.add_section("Output", Priority.Info, synthetic_text(size, seed=i), html="")
+        writeup.save(os.path.join(writeup_dir, name), save_txt=False)
+
+    gradedb = GradeDB(QUESTIONS, writeup_dir, os.path.join(root, "review"))
+    for i, name in enumerate(names[1::graded_every]):
+        gradedb.set_grades(name, {q.name: q.points - i % (q.points + 1) for q in QUESTIONS})
+    return gradedb
+
+
+def list_steps(app) -> list:
+    """Moving around the student list and filtering it."""
+    return ([curses.KEY_DOWN] * 40 + [curses.KEY_NPAGE] * 10 + [curses.KEY_UP] * 20 + [curses.KEY_PPAGE] * 5 +
+            [curses.KEY_END, curses.KEY_HOME] +
+            [ord("l")] + list("s000") + [curses.ascii.NL] + [ord("n")] * 10 + [ord("N")] * 5 + [ord("L")])
+
+
+def edit_steps(app) -> list:
+    """Opening the first student, grading them and paging through their writeup."""
+    # Open the writeup once it's loaded so its loading time isn't counted against the key.
+    return ([app.loader.wait_until_idle, curses.ascii.NL] +
+            list("7") + [curses.ascii.TAB] + list("15") + [curses.ascii.TAB] + list("5") + [curses.ascii.TAB] +
+            [curses.KEY_DOWN] * 60 + [curses.KEY_NPAGE] * 30 + [curses.KEY_END] + [curses.KEY_PPAGE] * 10 +
+            [curses.KEY_UP] * 20 + [curses.KEY_HOME] + [curses.ascii.ctrl(ord("s"))] + [curses.KEY_DOWN] * 5)
+
+
+def run_scenario(scenario, gradedb: GradeDB, steps: Callable, writeup_bytes, lines=30,
+                 columns=120) -> BenchmarkResult:
+    """Runs the app against the curses stand-in until the keys from `steps(app)` run out."""
+    settings = dict(npyscreen.TEST_SETTINGS)
+    app = AddressBookApplication(gradedb)
+    try:
+        with FakeCurses(lines, columns) as screen:
+            script = KeyScript(screen, steps(app))
+            npyscreen.TEST_SETTINGS['INPUT_GENERATOR'] = script.keys()
+            npyscreen.TEST_SETTINGS['TEST_INPUT'] = None
+            npyscreen.TEST_SETTINGS['CONTINUE_AFTER_TEST_INPUT'] = False
+            try:
+                app.main()
+            except npyscreen.ExhaustedTestInput:
+                pass
+            finally:
+                npyspmfuncs.flush_screen()
+    finally:
+        npyscreen.TEST_SETTINGS.update(settings)
+        for writeup in app.writeups.values():
+            if hasattr(writeup, "close"):
+                writeup.close()
+    return BenchmarkResult(scenario, len(gradedb.students), writeup_bytes, script.first_paint, script.timings)
+
+
+def print_report(results: List[BenchmarkResult]):
+    print("{:<6} {:>8} {:>10} {:>5} {:>9} {:>8} {:>8} {:>8} {:>8} {:>10} {:>9} {:>8}".format(
+        "", "students", "writeup", "keys", "first ms", "p50 ms", "p90 ms", "p99 ms", "max ms", "draws/key",
+        "max draws", "updates"))
+    for r in results:
+        print("{:<6} {:>8} {:>10} {:>5} {:>9.1f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.1f} {:>9} {:>8.2f}".format(
+            r.scenario, r.students, format_size(r.writeup_bytes), len(r.timings), r.first_paint * 1000,
+            r.latency(0.5) * 1000, r.latency(0.9) * 1000, r.latency(0.99) * 1000, r.latency(1) * 1000,
+            r.mean_draws, r.max_draws, r.updates_per_key))
+
+
+def parse_size(size: str) -> int:
+    """Parses sizes like 512, 1K, 50M."""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    size = size.strip().upper().rstrip("B")
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def format_size(size: int) -> str:
+    for unit, scale in (("M", 1024 ** 2), ("K", 1024)):
+        if size >= scale:
+            return "{:.1f}{}".format(size / scale, unit)
+    return str(size)
+
+
+@click.command()
+@click.option('-n', '--students', multiple=True, type=int, default=(100, 1000, 10000), show_default=True,
+              help='Roster sizes to run the list benchmark with.')
+@click.option('-w', '--writeup-size', multiple=True, default=("1K", "1M", "50M"), show_default=True,
+              help='Sizes of the writeup opened by the edit benchmark.')
+@click.option('--edit-students', default=100, show_default=True, help='Roster size for the edit benchmark.')
+@click.option('--max-p99-ms', type=float, help='Exit with an error if any benchmark\'s p99 latency is above this.')
+def main(students, writeup_size, edit_students, max_p99_ms):
+    results = []
+    for count in students:
+        with tempfile.TemporaryDirectory() as root:
+            results.append(run_scenario("list", make_course(root, count), list_steps, 1024))
+    for size in map(parse_size, writeup_size):
+        with tempfile.TemporaryDirectory() as root:
+            course = make_course(root, edit_students, first_writeup_bytes=size)
+            results.append(run_scenario("edit", course, edit_steps, size))
+    print_report(results)
+
+    if max_p99_ms is not None:
+        slow = [r for r in results if r.latency(0.99) * 1000 > max_p99_ms]
+        for r in slow:
+            print("FAILED {} with {} students and a {} writeup: p99 {:.2f}ms > {}ms".format(
+                r.scenario, r.students, format_size(r.writeup_bytes), r.latency(0.99) * 1000, max_p99_ms))
+        if slow:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
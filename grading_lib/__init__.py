@@ -2,7 +2,7 @@ import sys
 
 assert sys.version_info.major >= 3 and sys.version_info.minor >= 6, "Only Python >= 3.6 supported"
 
-from grading_lib.git import GitRepo
+from grading_lib.git import GitRepo, GitRepoCache
 from grading_lib.roster import Roster
 from grading_lib.zip import extract_moodle_zip, extract_canvas_zip
 from grading_lib.dir import check_if_dir_contains_files
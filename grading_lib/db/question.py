@@ -1,53 +1,157 @@
+import fcntl
+import io
 import json
 import os
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
 from collections import defaultdict
-from typing import Dict, Optional
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+TAR_EXTS = ('.tar', '.tar.gz', '.tgz')
+
+
+class ReviewConflictError(Exception):
+    def __init__(self, x500, expected_version, version):
+        self.x500 = x500
+        self.expected_version = expected_version
+        self.version = version
+
+    def __str__(self):
+        return "{}'s review was changed by someone else (expected version {}, found {})".format(
+            self.x500, self.expected_version, self.version)
 
 
 class StudentReview:
-    def __init__(self, x500: str, scores: Dict[str, int]):
+    def __init__(self, x500: str, scores: Dict[str, int], version: int=0, updated: Dict[str, float]=None):
         self.x500 = x500
         self.scores = defaultdict(int)
         self.scores.update(scores)
+        self.version = version  # Bumped on every save, used to detect concurrent edits.
+        self.updated = dict(updated or {})  # question name -> when it was last set, used when merging.
 
-    def set(self, question_name: str, score: int):
+    def set(self, question_name: str, score: int, timestamp: float=None):
         self.scores[question_name] = score
+        self.updated[question_name] = time.time() if timestamp is None else timestamp
 
     def get(self, question_name: str):
         return self.scores[question_name]
 
+    def merge(self, other: 'StudentReview') -> bool:
+        """Takes each of `other`'s scores which were set more recently than ours (last writer wins).
+
+        Scores without a timestamp (saved before timestamps were kept) count as older than any timestamped score.
+
+        Returns:
+            True if any score changed.
+        """
+        changed = False
+        for question_name, score in other.scores.items():
+            theirs = other.updated.get(question_name, 0)
+            ours = self.updated.get(question_name, 0)
+            if question_name not in self.scores or theirs > ours:
+                if self.scores.get(question_name) != score:
+                    changed = True
+                self.scores[question_name] = score
+                if theirs:
+                    self.updated[question_name] = theirs
+        return changed
+
     @property
     def score(self):
         return sum(self.scores.values())
 
     @classmethod
     def from_obj(cls, obj):
-        return cls(obj['x500'], obj['scores'])
+        return cls(obj['x500'], obj['scores'], obj.get('version', 0), obj.get('updated'))
 
     @property
     def obj(self):
         return {'x500': self.x500,
                 'score': self.score,
-                'scores': dict(self.scores)}
+                'scores': dict(self.scores),
+                'version': self.version,
+                'updated': self.updated}
+
+
+def load_reviews(path) -> Iterator[StudentReview]:
+    """Streams the review records out of a review directory, or a zip or tar archive of one."""
+    if os.path.isdir(path):
+        yield from ReviewDB(path).iter_records()
+    elif path.endswith(TAR_EXTS):
+        with tarfile.open(path, 'r:*') as tf:
+            for member in tf:
+                if member.isfile() and not os.path.basename(member.name).startswith('.'):
+                    yield StudentReview.from_obj(json.load(tf.extractfile(member)))
+    else:
+        with zipfile.ZipFile(path) as zf:
+            for name in sorted(zf.namelist()):
+                if not name.endswith('/') and not os.path.basename(name).startswith('.'):
+                    with zf.open(name) as fp:
+                        yield StudentReview.from_obj(json.load(fp))
 
 
 class ReviewDB:
+    """Review records stored as one json file per student.
+
+    Files starting with a '.' are lock and temporary files, not records.
+    """
     def __init__(self, root_dir: str = 'data/review'):
         self.root_dir = root_dir
+        self._locks = defaultdict(threading.Lock)  # x500 -> lock
+        self._locks_lock = threading.Lock()
 
         if not os.path.exists(root_dir):
             os.mkdir(root_dir)
 
+    def _record_files(self):
+        return sorted(file for file in os.listdir(self.root_dir) if not file.startswith('.'))
+
+    @contextmanager
+    def lock(self, x500):
+        """Holds an exclusive lock on a student's record, across threads and processes."""
+        with self._locks_lock:
+            lock = self._locks[x500]
+        with lock, open(os.path.join(self.root_dir, '.{}.lock'.format(x500)), 'w') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def update(self, x500, scores: Dict[str, int], expected_version: Optional[int]=None) -> StudentReview:
+        """Sets some of a student's scores, keeping any other scores saved since.
+
+        Raises:
+            ReviewConflictError if `expected_version` is given and the record has been saved since that version.
+        """
+        with self.lock(x500):
+            record = self.get(x500)
+            if expected_version is not None and record.version != expected_version:
+                raise ReviewConflictError(x500, expected_version, record.version)
+            for question_name, score in scores.items():
+                record.set(question_name, score)
+            self.save(record)
+        return record
+
     @property
     def records(self) -> Dict[str, StudentReview]:
         records = {}
-        for file in os.listdir(self.root_dir):
+        for file in self._record_files():
             with open(os.path.join(self.root_dir, file), 'r') as fp:
                 obj = json.load(fp)
                 record = StudentReview.from_obj(obj)
                 records[record.x500] = record
         return records
 
+    def iter_records(self) -> Iterator[StudentReview]:
+        """Loads the records one at a time in x500 order."""
+        for file in self._record_files():
+            yield self.get(file)
+
     def get(self, x500) -> StudentReview:
         path = os.path.join(self.root_dir, x500)
         if os.path.exists(path):
@@ -58,5 +162,59 @@ class ReviewDB:
             return StudentReview(x500, {})
 
     def save(self, record: StudentReview):
-        with open(os.path.join(self.root_dir, record.x500), 'w') as fp:
+        # Written to a temporary file first so readers never see a half written record.
+        record.version += 1
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, prefix='.{}.'.format(record.x500))
+        with os.fdopen(fd, 'w') as fp:
             json.dump(record.obj, fp)
+        os.replace(tmp_path, os.path.join(self.root_dir, record.x500))
+
+    def merge(self, records: Iterable[StudentReview]) -> List[StudentReview]:
+        """Merges other records into the db, see StudentReview.merge. Only records which changed are written.
+
+        Returns:
+            The merged records which changed.
+        """
+        changed = []
+        for other in records:
+            with self.lock(other.x500):
+                record = self.get(other.x500)
+                if record.merge(other):
+                    self.save(record)
+                    changed.append(record)
+        return changed
+
+    def save_as(self, path):
+        """Exports every record to a zip or tar archive (picked by extension) or, for any other path, a directory.
+
+        An existing directory is merged into, a missing one is created.
+        """
+        records = self.iter_records()
+        if path.endswith(TAR_EXTS):
+            with tarfile.open(path, 'w:gz' if path.endswith(('.gz', '.tgz')) else 'w') as tf:
+                for record in records:
+                    data = json.dumps(record.obj).encode('utf-8')
+                    info = tarfile.TarInfo(record.x500)
+                    info.size = len(data)
+                    info.mtime = time.time()
+                    tf.addfile(info, io.BytesIO(data))
+        elif path.endswith('.zip'):
+            with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for record in records:
+                    zf.writestr(record.x500, json.dumps(record.obj))
+        else:
+            os.makedirs(path, exist_ok=True)
+            # Both directories are walked in x500 order and joined as they go, so each record is read once and only
+            # the ones which change are written.
+            other = ReviewDB(path)
+            existing = other.iter_records()
+            theirs = next(existing, None)
+            for record in records:
+                while theirs is not None and theirs.x500 < record.x500:
+                    theirs = next(existing, None)
+                if theirs is not None and theirs.x500 == record.x500:
+                    target = theirs
+                else:
+                    target = StudentReview(record.x500, {})
+                if target.merge(record):
+                    other.save(target)
@@ -0,0 +1,136 @@
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from grading_lib.db.question import StudentReview
+
+
+class ScoreHistogram:
+    """Counts of each score, so mean, median and quartiles don't need every record.
+
+    Updates are O(1), queries are O(number of distinct scores) which is bounded by the question's points.
+    """
+    def __init__(self):
+        self.counts = Counter()  # score -> number of students
+        self.n = 0
+        self.total = 0
+
+    def add(self, score):
+        self.counts[score] += 1
+        self.n += 1
+        self.total += score
+
+    def remove(self, score):
+        self.counts[score] -= 1
+        if not self.counts[score]:
+            del self.counts[score]
+        self.n -= 1
+        self.total -= score
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.n if self.n else None
+
+    def quantile(self, q) -> Optional[float]:
+        if not self.n:
+            return None
+        # Linear interpolation between the closest ranks, the same as numpy's default.
+        pos = q * (self.n - 1)
+        lower, upper = int(pos), min(int(pos) + 1, self.n - 1)
+        seen = 0
+        lower_score = upper_score = None
+        for score in sorted(self.counts):
+            seen += self.counts[score]
+            if lower_score is None and seen > lower:
+                lower_score = score
+            if seen > upper:
+                upper_score = score
+                break
+        return lower_score + (upper_score - lower_score) * (pos - int(pos))
+
+    @property
+    def median(self) -> Optional[float]:
+        return self.quantile(0.5)
+
+    @property
+    def obj(self):
+        return {'count': self.n,
+                'mean': self.mean,
+                'median': self.median,
+                'histogram': {str(score): count for score, count in sorted(self.counts.items())}}
+
+
+class ReviewStats:
+    """Aggregate review progress and score statistics, kept up to date one record at a time.
+
+    A student's total is their review score plus their automatic grade from the grade db (`base_scores`).
+    """
+    def __init__(self, questions: Iterable[str], students: Iterable[str], records: Iterable[StudentReview]=(),
+                 base_scores: Dict[str, int]=None):
+        self.questions = list(questions)
+        self.students = set(students)
+        self.base_scores = base_scores or {}
+        self.reviewed = set()
+        self.by_question = {name: ScoreHistogram() for name in self.questions}
+        self.totals = ScoreHistogram()
+        self.students_by_total = defaultdict(set)  # total -> x500s
+        self._lock = threading.RLock()
+
+        for record in records:
+            self.update(None, record)
+
+    def total_for(self, record: StudentReview):
+        return self.base_scores.get(record.x500, 0) + record.score
+
+    def update(self, old: Optional[StudentReview], new: StudentReview):
+        """Replaces a student's previous record (if they had one) with their new one."""
+        if new.x500 not in self.students:
+            return
+        with self._lock:
+            if old is not None and old.x500 in self.reviewed:
+                self._apply(old, remove=True)
+            self._apply(new)
+            self.reviewed.add(new.x500)
+
+    def _apply(self, record: StudentReview, remove=False):
+        for name, histogram in self.by_question.items():
+            score = record.scores.get(name, 0)
+            if remove:
+                histogram.remove(score)
+            else:
+                histogram.add(score)
+        total = self.total_for(record)
+        if remove:
+            self.totals.remove(total)
+            self.students_by_total[total].discard(record.x500)
+        else:
+            self.totals.add(total)
+            self.students_by_total[total].add(record.x500)
+
+    def outliers(self, k=1.5) -> List[str]:
+        """Reviewed students whose total is more than `k` interquartile ranges outside the middle half."""
+        with self._lock:
+            if self.totals.n < 4:
+                return []
+            q1, q3 = self.totals.quantile(0.25), self.totals.quantile(0.75)
+            low, high = q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+            return sorted(x500 for total, x500s in self.students_by_total.items() if total < low or total > high
+                          for x500 in x500s)
+
+    def summary(self) -> str:
+        with self._lock:
+            mean, median = self.totals.mean, self.totals.median
+            return "Reviewed {}/{}  mean {}  median {}  outliers {}".format(
+                len(self.reviewed), len(self.students),
+                "-" if mean is None else "{:.1f}".format(mean),
+                "-" if median is None else "{:g}".format(median),
+                len(self.outliers()))
+
+    @property
+    def obj(self):
+        with self._lock:
+            return {'reviewed': len(self.reviewed),
+                    'unreviewed': len(self.students) - len(self.reviewed),
+                    'total': self.totals.obj,
+                    'questions': {name: histogram.obj for name, histogram in self.by_question.items()},
+                    'outliers': self.outliers()}
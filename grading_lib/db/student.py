@@ -1,6 +1,6 @@
 import json
 import os
-from typing import Dict, List
+from typing import Dict, Iterator, List
 
 
 class Student:
@@ -83,6 +83,11 @@ class StudentDB:
                 students[student.x500] = student
         return students
 
+    def iter_students(self) -> Iterator[Student]:
+        """Loads the students one at a time in x500 order."""
+        for file in sorted(os.listdir(self.root_dir)):
+            yield self.get(file)
+
     @property
     def not_done_students(self) -> Dict[str, Student]:
         return {s.x500: s for s in self.students.values() if not s.done}
@@ -1,65 +1,190 @@
-import os
 import hashlib
+import json
+import os
 import shutil
 import subprocess
+import tempfile
+import threading
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+from typing import Dict, Iterable, Optional
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_ALGORITHM = 'blake2b'  # Usually faster than sha512, xxhash's xxh3_128 is much faster if it is installed.
+HASH_BUF_SIZE = 1024 * 1024
+HASH_THREADS = os.cpu_count() or 1  # hashlib releases the GIL while hashing so threads scale fine here.
 
 
-def hash_file(filepath):
-    BUF_SIZE = 65536
-    sha512 = hashlib.sha512()
-    with open(filepath, 'rb') as f:
+def new_hash(algorithm=DEFAULT_ALGORITHM):
+    """A hash object for a hashlib algorithm or, if xxhash is installed, one of xxhash's (e.g. 'xxh3_128')."""
+    if algorithm.startswith('xxh'):
+        assert xxhash is not None, "xxhash must be installed to use {}".format(algorithm)
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def hash_file(filepath, algorithm=DEFAULT_ALGORITHM):
+    h = new_hash(algorithm)
+    buf = bytearray(HASH_BUF_SIZE)
+    view = memoryview(buf)
+    with open(filepath, 'rb', buffering=0) as f:
         while True:
-            buf = f.read(BUF_SIZE)
-            if not buf:
+            n = f.readinto(buf)
+            if not n:
                 break
-            sha512.update(buf)
+            h.update(view[:n])
+
+    return h.hexdigest()
+
+
+class FileHasher(object):
+    """Hashes files on a thread pool, remembering each digest by the file's path, size, mtime and inode.
+
+    Unchanged files are never reread, so hashing the same starter directory for every student is nearly free. If
+    `cache_path` is given the digests are loaded from it and `save` (or leaving a with block) writes them back.
+    """
+    def __init__(self, cache_path=None, algorithm=DEFAULT_ALGORITHM, threads=HASH_THREADS):
+        self.cache_path = cache_path
+        self.algorithm = algorithm
+        self.threads = threads
+        self.hits = 0
+        self.misses = 0
+        self._digests = {}  # absolute path -> (size, mtime_ns, inode, digest)
+        self._dirty = False
+        self._lock = threading.Lock()
+        if cache_path is not None and os.path.exists(cache_path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r') as fp:
+                obj = json.load(fp)
+        except ValueError:
+            return  # A corrupt cache is just rebuilt.
+        if obj.get('algorithm') == self.algorithm:
+            self._digests = {path: tuple(entry) for path, entry in obj['files'].items()}
+
+    def save(self):
+        with self._lock:
+            if self.cache_path is None or not self._dirty:
+                return
+            obj = {'algorithm': self.algorithm, 'files': dict(self._digests)}
+            self._dirty = False
+        # Write then rename so a crash never leaves a half written cache.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.cache_path)), prefix='.hashes.')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(obj, fp)
+        os.replace(tmp_path, self.cache_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
 
-    return sha512.hexdigest()
+    def hash_file(self, filepath) -> str:
+        path = os.path.abspath(filepath)
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        entry = self._digests.get(path)
+        if entry is not None and entry[:3] == key:
+            self.hits += 1
+            return entry[3]
 
+        digest = hash_file(path, self.algorithm)
+        with self._lock:
+            self.misses += 1
+            self._digests[path] = key + (digest,)
+            self._dirty = True
+        return digest
 
-def get_hashes_for_dir(dirpath, recurive=False):
-    hashes = {}
+    def hash_files(self, filepaths: Iterable[str]) -> Dict[str, str]:
+        """Hashes several files at once, returns path -> digest in the order given."""
+        filepaths = list(filepaths)
+        if self.threads <= 1 or len(filepaths) <= 1:
+            digests = [self.hash_file(path) for path in filepaths]
+        else:
+            with ThreadPool(min(self.threads, len(filepaths))) as pool:
+                digests = pool.map(self.hash_file, filepaths)
+        return dict(zip(filepaths, digests))
+
+
+_default_hasher = FileHasher()  # Only cached in memory, for the life of the process.
+
+
+def default_hasher() -> FileHasher:
+    return _default_hasher
+
+
+def get_hashes_for_dir(dirpath, recurive=False, hasher: Optional[FileHasher]=None) -> Dict[str, str]:
+    """Hashes the files in a directory, returns their path relative to `dirpath` -> digest.
+
+    Keying on the relative path means files with the same name in different subdirectories are all kept.
+    """
+    hasher = hasher or default_hasher()
 
     if recurive:
-        for root, dirs, files in os.walk(dirpath):
-            for fn in files:
-                hashes[fn] = hash_file(os.path.join(root, fn))
+        files = [os.path.join(root, fn) for root, dirs, files in os.walk(dirpath) for fn in files]
     else:
-        files = list(map(lambda x: os.path.join(dirpath, x), os.listdir(dirpath)))
-        for fn in files:
-            hashes[os.path.basename(fn)] = hash_file(fn)
+        with os.scandir(dirpath) as it:
+            files = [entry.path for entry in it if entry.is_file()]
 
-    return hashes
+    return {os.path.relpath(fn, dirpath): digest for fn, digest in hasher.hash_files(files).items()}
 
 
-def check_if_dir_contains_files(basedir, otherdir, match_file_names=False):
-    org_hashes = get_hashes_for_dir(basedir)
-    other_hashes = get_hashes_for_dir(otherdir, recurive=True)
-    
-    if match_file_names:
-        # TODO: write this
-        raise NotImplementedError('Matching filenames isn\'t implemented yet')
-    else:
-        for h in org_hashes.values():
-            if h not in other_hashes.values():
-                return False
-    return True
+class DirComparison(namedtuple("DirComparison", ["matched", "modified", "missing"])):
+    """Where the files of a base directory turned up in another directory, paths are relative to their directory.
 
+    Attributes:
+        matched: Base file -> an identical file in the other directory.
+        modified: Base file -> the files in the other directory with its name, none of them identical to it.
+        missing: Base files with neither an identical copy nor a file with the same name.
+    """
+    @property
+    def contains_all(self) -> bool:
+        return not self.modified and not self.missing
 
-def number_of_same_files_in_dirs(basedir, otherdir, match_file_names=False):
-    org_hashes = get_hashes_for_dir(basedir)
-    other_hashes = get_hashes_for_dir(otherdir, recurive=True)
 
-    same_files = 0
+def compare_dirs(basedir, otherdir, match_file_names=False, hasher: Optional[FileHasher]=None) -> DirComparison:
+    """Checks which of the files directly in `basedir` are somewhere in `otherdir` (or its subdirectories).
 
-    if match_file_names:
-        # TODO: write this
-        raise NotImplementedError('Matching filenames isn\'t implemented yet')
-    else:
-        for h in org_hashes.values():
-            if h in other_hashes.values():
-                same_files += 1
-    return same_files
+    A copy with the same name is preferred. If `match_file_names` is True only a copy with the same name counts,
+    otherwise an identical file under any name does.
+    """
+    base_hashes = get_hashes_for_dir(basedir, hasher=hasher)
+    other_hashes = get_hashes_for_dir(otherdir, recurive=True, hasher=hasher)
+
+    by_digest = {}  # digest -> first path with it
+    by_name = {}  # file name -> {digest -> first path with them}
+    for path, digest in sorted(other_hashes.items()):
+        by_digest.setdefault(digest, path)
+        by_name.setdefault(os.path.basename(path), {}).setdefault(digest, path)
+
+    matched, modified, missing = {}, {}, []
+    for path, digest in sorted(base_hashes.items()):
+        same_name = by_name.get(os.path.basename(path), {})
+        found = same_name.get(digest)
+        if found is None and not match_file_names:
+            found = by_digest.get(digest)
+        if found is not None:
+            matched[path] = found
+        elif same_name:
+            modified[path] = sorted(same_name.values())
+        else:
+            missing.append(path)
+    return DirComparison(matched, modified, missing)
+
+
+def check_if_dir_contains_files(basedir, otherdir, match_file_names=False, hasher: Optional[FileHasher]=None):
+    return compare_dirs(basedir, otherdir, match_file_names, hasher).contains_all
+
+
+def number_of_same_files_in_dirs(basedir, otherdir, match_file_names=False, hasher: Optional[FileHasher]=None):
+    return len(compare_dirs(basedir, otherdir, match_file_names, hasher).matched)
 
 
 def hard_remove_dir(path):
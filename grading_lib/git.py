@@ -1,7 +1,9 @@
 import os
 import shutil
 import sys
-from typing import Optional, Union, List
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Callable, Optional, Union, List
 
 import git
 
@@ -112,11 +114,65 @@ class GitRepo(object):
         else:
             origin.pull(branch, progress=progress)
 
+    def close(self):
+        """Releases the underlying git.Repo (and its cat-file helper processes). It is reopened on next use."""
+        if self._repo is not None:
+            self._repo.close()
+            self._repo = None
+
     def remove(self):
-        self._repo = None
+        self.close()
         shutil.rmtree(self.path)
 
 
+class GitRepoCache(object):
+    """A bounded, least recently used cache of GitRepo handles keyed by x500.
+
+    Every open GitRepo holds file handles and persistent git helper processes, so only `max_size` of them are kept
+    open at once. Evicted repos are closed explicitly.
+    """
+    CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+    def __init__(self, factory: Callable[[str], GitRepo], max_size: int=64):
+        self.factory = factory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._repos = OrderedDict()  # x500 -> GitRepo
+        self._lock = threading.Lock()
+
+    def get(self, x500: str) -> GitRepo:
+        with self._lock:
+            repo = self._repos.get(x500)
+            if repo is not None:
+                self.hits += 1
+                self._repos.move_to_end(x500)
+                return repo
+
+            self.misses += 1
+            repo = self.factory(x500)
+            self._repos[x500] = repo
+            while len(self._repos) > self.max_size:
+                _, evicted = self._repos.popitem(last=False)
+                evicted.close()
+            return repo
+
+    def __contains__(self, x500):
+        return x500 in self._repos
+
+    def __len__(self):
+        return len(self._repos)
+
+    def cache_info(self) -> 'GitRepoCache.CacheInfo':
+        return self.CacheInfo(self.hits, self.misses, self.max_size, len(self._repos))
+
+    def clear(self):
+        with self._lock:
+            for repo in self._repos.values():
+                repo.close()
+            self._repos.clear()
+
+
 def list_committed_file_after_commit(repo, commit):
     cur_commit = repo.active_branch.commit
 
@@ -1,14 +1,14 @@
 import os
 from abc import ABC, abstractmethod
-from contextlib import suppress
-from typing import List, ClassVar
+from contextlib import suppress, ExitStack
+from typing import Dict, Iterable, Iterator, List, ClassVar
 
 from grading_lib import Question, Writeup
 from grading_lib.db.groups import GroupsDB
-from grading_lib.db.question import ReviewDB
+from grading_lib.db.question import ReviewDB, StudentReview
 from grading_lib.db.student import StudentDB
 from .errors import FetchError, InvalidSubmissionError
-from ..roster import Student, Roster
+from ..roster import Student, Roster, OutputFormat, dump_students
 
 
 class Grader(ABC):
@@ -32,6 +32,7 @@ class Grader(ABC):
     GRADE_THREADS = 1  # by default assume not thread safe.
     VERBOSE = False
     GROUP_BASED: ClassVar[bool] = False
+    EXPORT_FORMATS: ClassVar[List[OutputFormat]] = [OutputFormat.MOODLE]
 
     OUT_DIR = 'output'
     DATA_DIR = 'data'
@@ -94,8 +95,49 @@ class Grader(ABC):
         """
         pass
 
-    def export_grades(self, output_file):
-        self.roster.export_grades(output_file)
+    def export_grades(self, output_file, formats: Iterable[OutputFormat]=None):
+        """Streams the graded and reviewed students into a csv file per format in a single pass."""
+        paths = self.export_paths(output_file, formats)
+        with ExitStack() as stack:
+            outputs = {format: stack.enter_context(open(path, 'w', newline='')) for format, path in paths.items()}
+            dump_students(self.graded_students(), outputs)
+
+    def export_paths(self, output_file, formats: Iterable[OutputFormat]=None) -> Dict[OutputFormat, str]:
+        """When exporting more than one format the format's name is added to each file name."""
+        formats = list(formats or self.EXPORT_FORMATS)
+        if len(formats) == 1:
+            return {formats[0]: output_file}
+        root, ext = os.path.splitext(output_file)
+        return {format: "{}.{}{}".format(root, format.name.lower(), ext) for format in formats}
+
+    def graded_students(self) -> Iterator[Student]:
+        """Yields every student on the roster in x500 order with their grade and review merged in.
+
+        The roster, grade db and review db are all walked in x500 order and joined as they go, so only one record of
+        each is loaded at a time. The roster's students aren't modified.
+        """
+        graded = self.grade_db().iter_students()
+        reviews = self.review_db().iter_records()
+        grade = next(graded, None)
+        review = next(reviews, None)
+        for student in self.roster:
+            while grade is not None and grade.x500 < student.x500:
+                grade = next(graded, None)
+            while review is not None and review.x500 < student.x500:
+                review = next(reviews, None)
+
+            row = Student(student.x500, student.fname, student.lname, student.external_id, student.extra_tags)
+            if grade is not None and grade.x500 == student.x500:
+                row.score = grade.score
+                row.comment = grade.comment
+
+                review_rec = StudentReview(student.x500, {})
+                if review is not None and review.x500 == student.x500:
+                    review_rec = review
+                row.score += review_rec.score
+                for question in self.manual_questions:
+                    row.add_cmt(question.get_msg(review_rec.get(question.name)))
+            yield row
 
     @property
     def manual_questions(self) -> List[Question]:
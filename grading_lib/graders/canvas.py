@@ -7,6 +7,7 @@ from .. import extract_canvas_zip
 
 class CanvasGrader(Grader):
     EXTRACT_SUBMISSION = False
+    EXPORT_FORMATS = [OutputFormat.CANVAS]
 
     def fetch(self):
         if not os.path.exists("canvas_dump"):
@@ -20,6 +21,3 @@ class CanvasGrader(Grader):
     @classmethod
     def fetch_student(cls, student):
         pass
-
-    def export_grades(self, output_file):
-        self.roster.export_grades(output_file, OutputFormat.CANVAS)
@@ -1,6 +1,5 @@
 import os
 from abc import abstractmethod
-from functools import lru_cache
 from typing import List
 
 from git import GitCommandError
@@ -9,11 +8,13 @@ from grading_lib.writeup import Priority
 from .base import Grader
 from .errors import *
 from .. import GitRepo, Writeup
+from ..git import GitRepoCache
 from ..roster import Student
 
 
 class GitGrader(Grader):
     FETCH_THREADS = 32  # We can have lots of threads since most of the time we are waiting on the network.
+    REPO_CACHE_SIZE = 64  # Max number of repos kept open at once.
 
     @staticmethod
     @abstractmethod
@@ -37,9 +38,16 @@ class GitGrader(Grader):
         ...
 
     @classmethod
-    @lru_cache()
-    def repo_for(cls, student):
-        return GitRepo(student.x500, cls.git_repo_url(student.x500), cache_dir="repos")
+    def repo_cache(cls) -> GitRepoCache:
+        # Each grader class gets its own cache since git_repo_url differs between them.
+        if '_repo_cache' not in cls.__dict__:
+            cls._repo_cache = GitRepoCache(lambda x500: GitRepo(x500, cls.git_repo_url(x500), cache_dir="repos"),
+                                           max_size=cls.REPO_CACHE_SIZE)
+        return cls._repo_cache
+
+    @classmethod
+    def repo_for(cls, student) -> GitRepo:
+        return cls.repo_cache().get(student.x500)
 
     @classmethod
     def fetch(cls):
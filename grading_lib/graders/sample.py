@@ -11,5 +11,7 @@ class FullyAutoGrader(Grader):
         return [PartialCreditQuestion("Added Partial Credit", "Partial Credit")] + super().manual_questions
 
     def manual_grade(self):
-        grader = QuestionGrader(self.manual_questions, self.write_ups_dir())
+        # The same totals as the web grader, which counts the automatic grades too.
+        grader = QuestionGrader(self.manual_questions, self.write_ups_dir(), self.review_db().root_dir,
+                                base_scores={s.x500: s.score for s in self.grade_db().iter_students()})
         grader.grade()
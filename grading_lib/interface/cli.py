@@ -8,7 +8,7 @@ from grading_lib.db.student import StudentGroup
 from .web import WebGrader
 from ..graders.base import Grader
 from ..graders.errors import GroupFetchError
-from ..roster import Roster, Student
+from ..roster import OutputFormat, Roster, Student
 
 
 class Context:
@@ -168,39 +168,37 @@ def run(grader_cls: Type[Grader]):
     @cli.command(short_help="Export the students' grades to a csv file.")
     @click.option('-o', '--output-file', default='grades.csv', type=click.Path(),
                   help='Path to the file to output. Should end in .csv')
-    def export(output_file):
+    @click.option('-f', '--format', 'formats', multiple=True, type=click.Choice([f.name.lower() for f in OutputFormat]),
+                  help='Format to export, can be given more than once. Defaults to the grader\'s format.')
+    def export(output_file, formats):
         """Puts all of the saved information together and export the students' grades and grading comments to a csv
-        file.
+        file. When exporting several formats, the format's name is added to each file name.
         """
-        if os.path.exists(output_file):
-            ans = ''
-            while ans not in ['y', 'n']:
-                ans = input(f"File {output_file} already exists. You are sure you want to override it [Y/N]? ").lower()
-            if ans == 'n':
-                print("Exiting...")
-                exit(0)
-            print("Overwriting...")
+        formats = [OutputFormat[f.upper()] for f in formats]
+        for path in context.grader.export_paths(output_file, formats).values():
+            if os.path.exists(path):
+                ans = ''
+                while ans not in ['y', 'n']:
+                    ans = input(f"File {path} already exists. You are sure you want to override it [Y/N]? ").lower()
+                if ans == 'n':
+                    print("Exiting...")
+                    exit(0)
+                print("Overwriting...")
 
         assert context.student is None, "Exporting single student's grade isn't currently supported."
 
-        for x500, student in grader_cls.grade_db().students.items():
-            s = context.grader.roster.students[x500]
-            s.score = student.score
-            s.comment = student.comment
+        context.grader.export_grades(output_file, formats)
 
-            review_rec = grader_cls.review_db().get(x500)
-            s.score += review_rec.score
-            for question in context.grader.manual_questions:
-                s.add_cmt(question.get_msg(review_rec.get(question.name)))
-
-        context.grader.export_grades(output_file)
-
-    @cli.command(short_help="Start the server (To be implemented)")
-    def serve():
-        """This serves a local web server that allows the grader a have a nice web interface instead of a cli.
-        This feature is yet to be implemented.
+    @cli.command(short_help="Start the review server.")
+    @click.option('--host', default='127.0.0.1', help='The interface to listen on.')
+    @click.option('--port', default=5000, type=int, help='The port to listen on.')
+    @click.option('--threads', default=8, type=int, help='Number of requests to serve at once.')
+    @click.option('--reviewers', default='', help='Comma separated reviewer names to split the students between.')
+    def serve(host, port, threads, reviewers):
+        """This serves a local web server that allows the graders a have a nice web interface instead of a cli.
+        Several reviewers can use it at once, each picks their name by opening `/?reviewer=<name>`.
         """
-        raise NotImplemented("This feature is not currently implemented.")
-        WebGrader(context.grader).run()
+        reviewers = [r.strip() for r in reviewers.split(',') if r.strip()]
+        WebGrader(context.grader).run(reviewers, host=host, port=port, threads=threads)
 
     cli(obj={})
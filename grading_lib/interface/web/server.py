@@ -1,29 +1,206 @@
+import gzip
+import hashlib
 import os
-from flask import Flask, request, render_template, redirect
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from flask import Flask, Response, request, render_template, redirect, jsonify, abort
+from ...db.question import ReviewConflictError
 from ...question import GradeDB
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 app = Flask(__name__)
 
+STATIC_MAX_AGE = 365 * 24 * 60 * 60  # Static urls are versioned so they can be cached "forever".
+COMPRESS_MIN_SIZE = 500
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript')
+COMPRESSED_STATIC_CACHE_SIZE = 64
+PREFETCH_SECTIONS = 3  # Sections of a writeup, after the first, to load while its grade page is rendered.
+
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = STATIC_MAX_AGE
+compressed_static = OrderedDict()  # (etag, encoding) -> compressed body
+compressed_static_lock = threading.Lock()  # Requests are served on several threads.
+
 
 class Data:
     gradedb = None
     grader = None
 
 
+def current_reviewer():
+    """The reviewer making the request, picked with `?reviewer=<name>` and remembered in a cookie."""
+    return request.args.get('reviewer') or request.cookies.get('reviewer')
+
+
+@app.after_request
+def remember_reviewer(response):
+    if 'reviewer' in request.args:
+        response.set_cookie('reviewer', request.args['reviewer'])
+    return response
+
+
+@app.url_defaults
+def version_static_urls(endpoint, values):
+    """Adds the file's mtime to static urls so a changed file gets a new url."""
+    if endpoint == 'static' and 'filename' in values:
+        path = os.path.join(app.static_folder, values['filename'])
+        if os.path.isfile(path):
+            values['v'] = int(os.path.getmtime(path))
+
+
+@app.after_request
+def cache_static(response):
+    if request.endpoint == 'static' and response.status_code in (200, 304):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+@app.after_request
+def compress(response):
+    """Compresses text responses with brotli (if installed) or gzip, whichever the client accepts."""
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers \
+            or not response.mimetype.startswith(COMPRESSIBLE_TYPES):
+        return response
+    accepted = request.accept_encodings
+    if brotli is not None and 'br' in accepted:
+        encoding = 'br'
+    elif 'gzip' in accepted:
+        encoding = 'gzip'
+    else:
+        return response
+
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    etag, _ = response.get_etag()
+    if request.endpoint == 'static' and etag:
+        # Static files don't change so only compress them once.
+        key = (etag, encoding)
+        with compressed_static_lock:
+            body = compressed_static.get(key)
+        if body is None:
+            # Compressed outside the lock, at worst two threads compress the same file once each.
+            body = compress_body(data, encoding)
+            with compressed_static_lock:
+                compressed_static[key] = body
+                while len(compressed_static) > COMPRESSED_STATIC_CACHE_SIZE:
+                    compressed_static.popitem(last=False)
+    else:
+        body = compress_body(data, encoding)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(etag, weak=True)  # The compressed body is a different representation.
+    return response
+
+
+def not_modified(etag, last_modified: Optional[datetime]):
+    """Whether the client's cached copy (by ETag, or failing that Last-Modified) is still current."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return last_modified is not None and request.if_modified_since is not None \
+        and last_modified <= request.if_modified_since
+
+
+def conditional(etag, last_modified: Optional[datetime], render):
+    """Answers 304 Not Modified without calling `render` when the client already has the page.
+
+    Pass no `last_modified` for pages which depend on more than a file's mtime, so only the ETag is trusted.
+    """
+    if last_modified is not None:
+        last_modified = last_modified.replace(microsecond=0)
+    if not_modified(etag, last_modified):
+        response = Response(status=304)
+    else:
+        response = app.make_response(render())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # Always revalidate, it's cheap.
+    return response
+
+
+def writeup_etag(*parts):
+    return hashlib.sha1(":".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
 @app.route('/')
 def index():
     if Data.grader is None:
         return redirect("/grade")
-    return render_template('index.html', lab_name="Lab 2", roster=Data.grader.roster)
+    return render_template('index.html', lab_name="Lab 2")
+
+
+def paginate(items):
+    """Slices `items` by the `page` and `per_page` query args."""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+    start = (page - 1) * per_page
+    return {'total': len(items), 'page': page, 'per_page': per_page, 'items': items[start:start + per_page]}
+
+
+@app.route('/api/roster')
+def api_roster():
+    if Data.grader is None:
+        abort(404)
+    search = request.args.get('q', '').casefold()
+    students = [s for s in Data.grader.roster
+                if not search or search in s.x500.casefold() or search in s.get_name().casefold()]
+    result = paginate(students)
+    result['items'] = [{'x500': s.x500, 'fname': s.fname, 'lname': s.lname} for s in result['items']]
+    return jsonify(result)
+
+
+@app.route('/api/rows')
+def api_rows():
+    sort = request.args.get('sort', 'x500')
+    reverse = sort.startswith('-')
+    sort = sort.lstrip('-')
+    if sort not in Data.gradedb.Row._fields:
+        abort(400)
+    rows = Data.gradedb.query_rows(ungraded=request.args.get('ungraded', type=int) == 1,
+                                   min_score=request.args.get('min_score', type=int),
+                                   max_score=request.args.get('max_score', type=int),
+                                   search=request.args.get('q'),
+                                   sort=sort, reverse=reverse,
+                                   reviewer=current_reviewer() if request.args.get('mine', type=int) == 1 else None)
+    result = paginate(rows)
+    result['items'] = [row._asdict() for row in result['items']]
+    return jsonify(result)
+
+
+@app.route('/api/stats')
+def api_stats():
+    return jsonify(Data.gradedb.stats.obj)
 
 
 @app.route('/merge', methods=["GET", "POST"])
 def merge():
     if request.method == 'POST':
-        src = request.form.get("src")
         origin = request.form.get("origin")
 
         try:
-            Data.gradedb.merge(src)
+            for src in request.form.getlist("src"):
+                Data.gradedb.merge(src)
             return redirect(origin)
         except:
             return "There was an error :("
@@ -31,7 +208,8 @@ def merge():
         origin = request.form.get("origin", "/grade")
         files = os.listdir("output")
         files = map(lambda x: os.path.abspath("output/"+x), files)
-        files = list(filter(os.path.isfile, files))
+        # Review directories or archives of them.
+        files = list(filter(os.path.exists, files))
         return render_template('merge.html', files=files, origin=origin)
 
 
@@ -45,9 +223,12 @@ def grade():
             grades[question.name] = int(request.form.get(question.name))
         # request.form.get('pass')
         if x500 and len(grades) == len(Data.gradedb.questions):
-            for name, grade in grades.items():
-                Data.gradedb.set_grade(x500, name, grade)
-            message = "Set grades for {}".format(x500)
+            try:
+                Data.gradedb.set_grades(x500, grades, expected_version=request.form.get('version', type=int))
+                message = "Set grades for {}".format(x500)
+            except ReviewConflictError as e:
+                return render_template('grade.html', lab_name="Lab 2",
+                                       message="{}. Reopen {} to see their grades.".format(e, x500))
         else:
             message = "Error setting grades for {}".format(x500)
         action = request.form.get('action', 'save')
@@ -55,22 +236,43 @@ def grade():
             save()
         elif action == 'save_next':
             save()
-            i = 0
-            rows = Data.gradedb.get_rows()
-            while rows[i].x500 != x500:
-                i += 1
-            i += 1
-            if i < len(rows):
-                return redirect("/grade/{}".format(rows[i].x500))
+            next_x500 = Data.gradedb.next_student(x500, current_reviewer())
+            if next_x500 is not None:
+                return redirect("/grade/{}".format(next_x500))
         # print("Got:", grades, "for", x500)
         # message =
-    return render_template('grade.html', lab_name="Lab 2", rows=Data.gradedb.get_rows(), message=message)
+    return render_template('grade.html', lab_name="Lab 2", message=message)
 
 
 @app.route('/grade/<x500>')
 def grade_student(x500):
-    return render_template('grade_student.html', questions=Data.gradedb.questions, x500=x500, writeup=Data.gradedb.get_writeup(x500),
-                           grades=Data.gradedb.get_grades(x500))
+    mtime = Data.gradedb.get_writeup_mtime(x500)
+    record = Data.gradedb.refresh(x500)
+    reviewer = current_reviewer()
+    etag = writeup_etag(x500, mtime, record.version, reviewer, Data.gradedb.reviewer_for(x500),
+                        Data.gradedb.previous_student(x500))
+
+    def render():
+        # Only the first section is rendered up front, the rest are fetched as they are viewed.
+        index = Data.gradedb.get_writeup_index(x500)
+        first = Data.gradedb.get_writeup_section(x500, 0) if index else None
+        # The page fetches the sections after the first one straight away, and the next student is likely next.
+        Data.gradedb.prefetch_writeup(x500, range(1, min(len(index), 1 + PREFETCH_SECTIONS)))
+        Data.gradedb.prefetch_writeup(Data.gradedb.next_student(x500, reviewer))
+        return render_template('grade_student.html', questions=Data.gradedb.questions, x500=x500, writeup=index,
+                               first_section=first, grades=Data.gradedb.get_grades(x500), version=record.version,
+                               previous=Data.gradedb.previous_student(x500),
+                               assigned_to=Data.gradedb.reviewer_for(x500), reviewer=reviewer)
+
+    # No Last-Modified: the page also shows grades, which change more often than the writeup and within a second.
+    return conditional(etag, None, render)
+
+
+@app.route('/grade/<x500>/section/<int:i>')
+def grade_student_section(x500, i):
+    mtime = Data.gradedb.get_writeup_mtime(x500)
+    return conditional(writeup_etag(x500, mtime, i), datetime.fromtimestamp(mtime, timezone.utc),
+                       lambda: Data.gradedb.get_writeup_section(x500, i)['html'])
 
 
 @app.route('/save')
@@ -88,6 +290,19 @@ def kill():
     return "Shutting down..."
 
 
+def serve(host='127.0.0.1', port=5000, threads=8):
+    """Serves the app to several reviewers at once.
+
+    Uses waitress if it is installed, otherwise falls back to werkzeug's threaded server.
+    """
+    try:
+        import waitress
+    except ImportError:
+        app.run(host=host, port=port, threaded=True)
+    else:
+        waitress.serve(app, host=host, port=port, threads=threads)
+
+
 if __name__ == '__main__':
     app.run()
 
@@ -98,10 +313,11 @@ class WebQuestionGrader:
         self.writeup_dir = writeup_dir
         self.save_loc = save_loc
 
-    def grade(self):
+    def grade(self, reviewers=None, **serve_args):
         """Returns True if finished grading otherwise False"""
         Data.gradedb = GradeDB(self.questions, self.writeup_dir, self.save_loc)
-        app.run()
+        Data.gradedb.assign_reviewers(reviewers)
+        serve(**serve_args)
         return False
 
     def load(self):
@@ -112,6 +328,9 @@ class WebGrader:
     def __init__(self, grader):
         Data.grader = grader
 
-    def run(self):
-        Data.gradedb = GradeDB(Data.grader.manual_questions, Data.grader.write_ups_dir, Data.grader.save_loc)
-        app.run()
+    def run(self, reviewers=None, **serve_args):
+        Data.gradedb = GradeDB(Data.grader.manual_questions, Data.grader.write_ups_dir(),
+                               Data.grader.review_db().root_dir)
+        Data.gradedb.set_base_scores({s.x500: s.score for s in Data.grader.grade_db().iter_students()})
+        Data.gradedb.assign_reviewers(reviewers)
+        serve(**serve_args)
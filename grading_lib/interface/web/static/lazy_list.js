@@ -0,0 +1,56 @@
+// Loads a paginated JSON list (see `paginate` in server.py) a page at a time as the user scrolls.
+function LazyList(container, url, renderItem, form) {
+  this.container = container;
+  this.url = url;
+  this.renderItem = renderItem;
+  this.form = form;
+  this.sentinel = document.createElement("div");
+  this.container.after(this.sentinel);
+
+  var self = this;
+  this.observer = new IntersectionObserver(function (entries) {
+    if (entries[0].isIntersecting) self.loadNext();
+  });
+  this.observer.observe(this.sentinel);
+  if (form) {
+    form.addEventListener("input", function () { self.reset(); });
+    form.addEventListener("submit", function (e) { e.preventDefault(); self.reset(); });
+  }
+  this.reset();
+}
+
+LazyList.prototype.reset = function () {
+  this.page = 0;
+  this.done = false;
+  this.generation = (this.generation || 0) + 1;
+  this.loading = false;
+  this.container.innerHTML = "";
+  this.loadNext();
+};
+
+LazyList.prototype.loadNext = function () {
+  if (this.loading || this.done) return;
+  this.loading = true;
+  var self = this;
+  var generation = this.generation;
+  var params = new URLSearchParams(this.form ? new FormData(this.form) : undefined);
+  params.set("page", this.page + 1);
+  fetch(this.url + "?" + params.toString()).then(function (r) { return r.json(); }).then(function (result) {
+    if (generation !== self.generation) return;  // The filters changed while loading.
+    result.items.forEach(function (item) { self.container.appendChild(self.renderItem(item)); });
+    self.page = result.page;
+    self.done = result.page * result.per_page >= result.total;
+    self.loading = false;
+    // Keep going until the page is full.
+    var rect = self.sentinel.getBoundingClientRect();
+    if (!self.done && rect.top < window.innerHeight) self.loadNext();
+  });
+};
+
+function listLink(href, text) {
+  var a = document.createElement("a");
+  a.href = href;
+  a.className = "list-group-item list-group-item-action";
+  a.textContent = text;
+  return a;
+}
@@ -50,6 +50,7 @@ from .wgwidget                  import DummyWidget, NotEnoughSpaceForWidget
 from . import wgwidget as widget
 
 from .wgmultiline               import MultiLine, Pager, TitleMultiLine, TitlePager, MultiLineAction, BufferPager, TitleBufferPager
+from .wgmultiline               import VirtualPager
 from .wgmultiselect             import MultiSelect, TitleMultiSelect, MultiSelectFixed, \
                                        TitleMultiSelectFixed, MultiSelectAction
 from .wgeditmultiline           import MultiLineEdit
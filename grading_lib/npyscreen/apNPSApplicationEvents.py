@@ -1,25 +1,101 @@
 import collections
+import fcntl
+import os
+import threading
 import weakref
 from .apNPSApplicationManaged import NPSAppManaged
 from .eveventhandler import EventHandler
+from . import npyspmfuncs as pmfuncs
 
 class NPSEventQueue(object):
-    def __init__(self):
-        self.interal_queue = collections.deque()
+    """A first in, first out queue of events, safe to put to from other threads.  
+    
+    Putting an event writes to a pipe, so the application can wait for either a keypress or an event (see fileno).  
+    Events created with coalesce=True replace any event with the same name still waiting in the queue, so a 
+    producer can report progress as often as it likes without flooding the interface.  When maxlen events are 
+    waiting, put blocks other threads until there is room, but never blocks the thread taking events out."""
+    DEFAULT_MAXLEN = 1000
+    def __init__(self, maxlen=None):
+        self.maxlen = maxlen or self.DEFAULT_MAXLEN
+        self.internal_queue = collections.deque()
+        self._coalesced = {} # name -> latest event, for coalescing events in the queue
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._consumer = None
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        for fd in (self._wakeup_read, self._wakeup_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._signalled = False
+    
+    def fileno(self):
+        "A file descriptor that is readable while there are events waiting."
+        return self._wakeup_read
+    
+    def __len__(self):
+        return len(self.internal_queue)
     
     def get(self, maximum=None):
-        if maximum is None:
-            maximum = -1
-        counter = 1
-        while counter != maximum:
-            try:
-                yield self.interal_queue.pop()
-            except IndexError:
-                raise StopIteration
+        "Yield up to maximum (or all) of the waiting events, oldest first."
+        self._consumer = threading.current_thread()
+        counter = 0
+        while maximum is None or maximum < 0 or counter < maximum:
+            with self._lock:
+                try:
+                    event = self.internal_queue.popleft()
+                except IndexError:
+                    self._clear_wakeup()
+                    return
+                if isinstance(event, _CoalescedEvent):
+                    event = self._coalesced.pop(event.name)
+                if not self.internal_queue:
+                    self._clear_wakeup()
+                self._not_full.notify()
+            yield event
             counter += 1
     
-    def put(self, event):
-        self.interal_queue.append(event)
+    def put(self, event, timeout=None):
+        with self._lock:
+            if getattr(event, 'coalesce', False) and event.name in self._coalesced:
+                self._coalesced[event.name] = event
+                return True
+            if threading.current_thread() is not self._consumer:
+                while len(self.internal_queue) >= self.maxlen:
+                    if not self._not_full.wait(timeout):
+                        return False
+            if getattr(event, 'coalesce', False):
+                self._coalesced[event.name] = event
+                self.internal_queue.append(_CoalescedEvent(event.name))
+            else:
+                self.internal_queue.append(event)
+            self._signal_wakeup()
+        return True
+    
+    def _signal_wakeup(self):
+        if not self._signalled:
+            try:
+                os.write(self._wakeup_write, b'.')
+            except BlockingIOError:
+                pass
+            self._signalled = True
+    
+    def _clear_wakeup(self):
+        if self._signalled:
+            try:
+                while os.read(self._wakeup_read, 512):
+                    pass
+            except BlockingIOError:
+                pass
+            self._signalled = False
+    
+    def close(self):
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+class _CoalescedEvent(object):
+    # Stands in the queue for the latest event with this name.
+    __slots__ = ('name',)
+    def __init__(self, name):
+        self.name = name
         
 class StandardApp(NPSAppManaged, EventHandler):
     MAINQUEUE_TYPE = NPSEventQueue
@@ -40,6 +116,14 @@ class StandardApp(NPSAppManaged, EventHandler):
         # Parent NPSAppManaged does not define this, so no need to call.
         self.process_event_queues(max_events_per_queue=self.max_events_per_queue)
     
+    def _internal_adjust_widgets(self):
+        # Also handle events after each keypress, so they aren't held up while the user is typing.
+        self.process_event_queues(max_events_per_queue=self.max_events_per_queue)
+    
+    def event_wakeup_filenos(self):
+        "File descriptors which become readable when an event is queued, so waiting for a key can stop early."
+        return [queue.fileno() for queue in self.event_queues.values() if hasattr(queue, 'fileno')]
+    
         
     def initalize_application_event_queues(self):
         # in the standard application the event queue is not threaded so...
@@ -47,9 +131,16 @@ class StandardApp(NPSAppManaged, EventHandler):
         self.event_queues['MAINQUEUE'] = main_queue
     
     def process_event_queues(self, max_events_per_queue=None):
-        for queue in self.event_queues.values():
-            for event in queue.get(maximum=max_events_per_queue):
-                self.process_event(event)
+        # Handlers often redraw, so show the result of the whole batch in one screen update.
+        already_deferred = pmfuncs.screen_updates_deferred()
+        pmfuncs.defer_screen_updates()
+        try:
+            for queue in self.event_queues.values():
+                for event in queue.get(maximum=max_events_per_queue):
+                    self.process_event(event)
+        finally:
+            if not already_deferred:
+                pmfuncs.flush_screen()
     
     def register_for_event(self, registering_object, event_name):
         if event_name not in self.event_directory:
@@ -2,9 +2,11 @@ import weakref
 
 class Event(object):
     # a basic event class
-    def __init__(self, name, payload=None):
+    def __init__(self, name, payload=None, coalesce=False):
         self.name = name
         self.payload = payload
+        # If True, this event replaces any event with the same name that is still waiting to be processed.
+        self.coalesce = coalesce
 
 
 class EventHandler(object):
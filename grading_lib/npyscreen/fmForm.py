@@ -327,6 +327,7 @@ class _FormBase(proto_fm_screen_area.ScreenArea,
             self.curses_pad.bkgdset(' ', color_attribute)
             self.curses_pad.attron(color_attribute)
         self.curses_pad.erase()
+        self.erase_count += 1
         self.draw_form()
         for w in [wg for wg in self._widgets__ if wg.hidden]:
             w.clear()
@@ -1,3 +1,5 @@
+import collections
+
 class NPSFilteredDataBase(object):
     def __init__(self, values=None):
         self._values  = None
@@ -28,10 +30,54 @@ class NPSFilteredDataBase(object):
         self._filtered_values = self.filter_data()
             
 class NPSFilteredDataList(NPSFilteredDataBase):
+    def __init__(self, values=None):
+        self._last_filter   = None
+        self._last_filtered = None
+        self._last_values   = None
+        self._last_len      = None
+        super(NPSFilteredDataList, self).__init__(values)
+
     def filter_data(self):
-        if self._filter and self.get_all_values():
-            return [x for x in self.get_all_values() if self._filter in x]
-        else:
-            return self.get_all_values()
+        values = self.get_all_values()
+        if not (self._filter and values):
+            self._last_filter = None
+            return values
+        if values is self._last_values and len(values) == self._last_len and self._last_filter:
+            if self._filter == self._last_filter:
+                return self._last_filtered
+            if self._last_filter in self._filter:
+                # Anything matching the longer filter also matched the previous one.
+                values = self._last_filtered
+        filtered = [x for x in values if self._filter in x]
+        self._last_filter   = self._filter
+        self._last_filtered = filtered
+        self._last_values   = self.get_all_values()
+        self._last_len      = len(self._last_values)
+        return filtered
+
+
+class TrigramIndex(object):
+    """An index of the three character sequences in a list of strings.  Used to find which strings 
+could contain a substring without searching every one of them."""
+    def __init__(self, strings):
+        self.size = len(strings)
+        self._index = collections.defaultdict(set)
+        self._unindexed = set()
+        for i, s in enumerate(strings):
+            if not isinstance(s, str):
+                self._unindexed.add(i)
+                continue
+            for j in range(len(s) - 2):
+                self._index[s[j:j+3]].add(i)
+
+    def candidates(self, substring):
+        "The sorted indexes of the strings which might contain substring.  Each still has to be checked."
+        if len(substring) < 3:
+            return range(self.size)
+        found = []
+        for j in range(len(substring) - 2):
+            found.append(self._index.get(substring[j:j+3], set()))
+        found.sort(key=len)
+        return sorted(set.intersection(*found) | self._unindexed)
     
     
@@ -33,3 +33,32 @@ def CallSubShell(subshell):
 
 hide_cursor = hidecursor
 show_cursor = showcursor
+
+# While a keypress is being handled the screen is only updated once, just before the next key is read,
+# rather than every time a form refreshes.
+_DEFER_SCREEN_UPDATES = False
+_SCREEN_UPDATE_PENDING = False
+
+def update_screen():
+    """Send the changes made with noutrefresh to the terminal.  If a keypress is being handled, this 
+    is put off until flush_screen is called."""
+    global _SCREEN_UPDATE_PENDING
+    if _DEFER_SCREEN_UPDATES:
+        _SCREEN_UPDATE_PENDING = True
+    else:
+        curses.doupdate()
+
+def screen_updates_deferred():
+    return _DEFER_SCREEN_UPDATES
+
+def defer_screen_updates():
+    global _DEFER_SCREEN_UPDATES
+    _DEFER_SCREEN_UPDATES = True
+
+def flush_screen():
+    "Send any pending changes to the terminal and stop deferring updates."
+    global _DEFER_SCREEN_UPDATES, _SCREEN_UPDATE_PENDING
+    _DEFER_SCREEN_UPDATES = False
+    if _SCREEN_UPDATE_PENDING:
+        _SCREEN_UPDATE_PENDING = False
+        curses.doupdate()
@@ -78,6 +78,7 @@ class ScreenArea(object):
             self.theme_manager = APPLICATION_THEME_MANAGER
         
         self.keypress_timeout = None
+        self.erase_count = 0 # Counts the times the whole pad has been erased, so widgets know to redraw.
         
 
         self._create_screen()
@@ -144,9 +145,10 @@ class ScreenArea(object):
         # Getting strange errors on OS X, with curses sometimes crashing at this point. 
         # Suspect screen size not updated in time. This try: seems to solve it with no ill effects.
         try:
-            self.curses_pad.refresh(self.show_from_y,self.show_from_x,self.show_aty,self.show_atx,_my,_mx)
+            self.curses_pad.noutrefresh(self.show_from_y,self.show_from_x,self.show_aty,self.show_atx,_my,_mx)
         except curses.error:
             pass
+        pmfuncs.update_screen()
         if self.show_from_y is 0 and \
         self.show_from_x is 0 and \
         (_my >= self.lines) and \
@@ -158,5 +160,6 @@ class ScreenArea(object):
     
     def erase(self):
         self.curses_pad.erase()
+        self.erase_count += 1
         self.refresh()
 
@@ -3,6 +3,7 @@ from . import wgmultiline
 from . import fmPopup
 import curses
 import textwrap
+from . import npyspmfuncs as pmfuncs
 
 class ConfirmCancelPopup(fmPopup.ActionPopup):
     def on_ok(self):
@@ -42,6 +43,8 @@ def notify(message, title="Message", form_color='STANDOUT',
         message = _wrap_message_lines(message, mlw_width)
     mlw.values = message
     F.display()
+    # notify is used to show progress, so show it now even if a keypress is being handled.
+    pmfuncs.flush_screen()
     
 def notify_confirm(message, title="Message", form_color='STANDOUT', wrap=True, wide=False,
                     editw = 0,):
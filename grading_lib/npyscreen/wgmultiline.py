@@ -6,6 +6,7 @@ import textwrap
 import curses
 from . import wgtitlefield   as titlefield
 from . import fmPopup        as Popup
+from .npysNPSFilteredData import TrigramIndex
 import weakref
 import collections
 import copy
@@ -47,6 +48,7 @@ the same effect can be achieved by altering the __str__() method of displayed ob
     _MINIMUM_HEIGHT = 2 # Raise an error if not given this.
     _contained_widgets = textbox.Textfield
     _contained_widget_height = 1
+    FILTER_INDEX_THRESHOLD = 1000 # Lists this long are filtered with a TrigramIndex.  None to never use one.
     def __init__(self, screen, values = None, value = None,
             slow_scroll=False, scroll_exit=False, 
             return_exit=False, select_exit=False,
@@ -58,6 +60,8 @@ the same effect can be achieved by altering the __str__() method of displayed ob
              **keywords):
         
         self.never_cache     = False
+        self._values_version = 0
+        self._clear_count    = 0
         self.exit_left       = exit_left
         self.exit_right      = exit_right
         self.allow_filtering = allow_filtering
@@ -90,10 +94,17 @@ the same effect can be achieved by altering the __str__() method of displayed ob
         #These are just to do some optimisation tricks
         self._last_start_display_at = None
         self._last_cursor_line = None
-        self._last_values = copy.copy(values)
+        self._last_values = None
+        self._last_values_state = None
         self._last_value = copy.copy(value)
         self._last_filter = None
+        self._filter_cache_values = None
+        self._filter_cache_state = None
         self._filtered_values_cache = []
+        self._display_strings = None
+        self._display_strings_values = None
+        self._display_strings_state = None
+        self._filter_index = None
 
         #override - it looks nicer.
         if self.scroll_exit: self.slow_scroll=True
@@ -117,6 +128,56 @@ the same effect can be achieved by altering the __str__() method of displayed ob
                 )
 
 
+    def _get_values(self):
+        return self._values
+    
+    def _set_values(self, values):
+        self._values = values
+        self.values_changed()
+    
+    values = property(_get_values, _set_values)
+    
+    def values_changed(self):
+        """Call this after changing self.values in place (rather than assigning a new list), so that 
+the next update redraws the lines.  Appending or removing items is noticed without it."""
+        self._values_version += 1
+    
+    def _values_state(self):
+        # Stands in for comparing the whole list: the same object, not marked as changed and the same length.
+        try:
+            length = len(self.values)
+        except TypeError:
+            length = None
+        return (id(self.values), self._values_version, length)
+    
+    def _values_unchanged(self, last_values, last_state):
+        return last_values is self.values and last_state == self._values_state()
+
+    def clear(self, usechar=' '):
+        super(MultiLine, self).clear(usechar)
+        self._clear_count += 1
+    
+    def _line_display_state(self, line):
+        # Everything that affects how a plain Textfield line looks, including whether the screen under it 
+        # has been cleared since it was printed.  Other kinds of line are always printed.
+        if type(line) is not textbox.Textfield:
+            return None
+        return (line.value, line.hidden, line.highlight, line.show_bold, line.important, line.color,
+                line.begin_at, line.editing, self._clear_count, getattr(self.parent, 'erase_count', None))
+    
+    def _update_line(self, line, clear=True):
+        "Print a line, unless it would look exactly the same as it did when it was last printed."
+        state = self._line_display_state(line)
+        if state is not None and state == getattr(line, '_printed_state', None):
+            return False
+        line.update(clear=clear)
+        line._printed_state = state
+        return True
+    
+    def _forget_line(self, line):
+        # Something other than _update_line drew over the line.
+        line._printed_state = None
+
     def display_value(self, vl):
         """Overload this function to change how values are displayed.  
 Should accept one argument (the object to be represented), and return a string or the 
@@ -140,7 +201,7 @@ object to be passed to the contained widget."""
         self.cursor_line      = 0
     
     def reset_display_cache(self):
-        self._last_values = False
+        self.values_changed()
         self._last_value  = False
     
     def update(self, clear=True):
@@ -182,7 +243,7 @@ object to be passed to the contained widget."""
         try:            
             if (self._safe_to_display_cache and \
                 self._last_value is self.value) and \
-                (self.values == self._last_values) and \
+                self._values_unchanged(self._last_values, self._last_values_state) and \
                 (self.start_display_at == self._last_start_display_at) and \
                 (clear != True) and \
                 (self._last_cursor_line == self.cursor_line) and \
@@ -210,10 +271,14 @@ object to be passed to the contained widget."""
             
             self._before_print_lines()
             indexer = 0 + self.start_display_at
+            show_cursor = self.editing or self.always_show_cursor
             for line in self._my_widgets[:-1]:
                 self._print_line(line, indexer)
+                if show_cursor and indexer == self.cursor_line:
+                    # Highlight it now rather than printing the line twice.
+                    self.set_is_line_cursor(line, True)
                 line.task = "PRINTLINE"
-                line.update(clear=True)
+                self._update_line(line, clear=True)
                 indexer += 1
         
             # Now do the final line
@@ -222,11 +287,12 @@ object to be passed to the contained widget."""
             if (len(self.values) <= indexer+1):# or (len(self._my_widgets)*self._contained_widget_height)<self.height:
                 self._print_line(line, indexer)
                 line.task="PRINTLINE"
-                line.update(clear=False)
+                self._update_line(line, clear=False)
             elif len((self._my_widgets)*self._contained_widget_height)<self.height:
                 self._print_line(line, indexer)
                 line.task="PRINTLINELASTOFSCREEN"
                 line.update(clear=False)
+                self._forget_line(line)
                 if self.do_colors():
                     self.parent.curses_pad.addstr(self.rely+self.height-1, self.relx, MORE_LABEL, self.parent.theme_manager.findPair(self, 'CONTROL'))
                 else:
@@ -238,6 +304,7 @@ object to be passed to the contained widget."""
                 #line.highlight = False
                 #line.show_bold = False
                 line.clear()
+                self._forget_line(line)
                 if self.do_colors():
                     self.parent.curses_pad.addstr(self.rely+self.height-1, self.relx, MORE_LABEL, self.parent.theme_manager.findPair(self, 'CONTROL'))
                 else:
@@ -245,7 +312,7 @@ object to be passed to the contained widget."""
         
             if self.editing or self.always_show_cursor: 
                 self.set_is_line_cursor(self._my_widgets[(self.cursor_line-self.start_display_at)], True)
-                self._my_widgets[(self.cursor_line-self.start_display_at)].update(clear=True)
+                self._update_line(self._my_widgets[(self.cursor_line-self.start_display_at)], clear=True)
             else:
                 # There is a bug somewhere that affects the first line.  This cures it.
                 # Without this line, the first line inherits the color of the form when not editing. Not clear why.
@@ -254,7 +321,8 @@ object to be passed to the contained widget."""
 
         self._last_start_display_at = self.start_display_at
         self._last_cursor_line = self.cursor_line
-        self._last_values = copy.copy(self.values)
+        self._last_values = self.values
+        self._last_values_state = self._values_state()
         self._last_value  = copy.copy(self.value)
         
         # This will prevent the program crashing if the user has changed values, and the cursor 
@@ -320,24 +388,46 @@ object to be passed to the contained widget."""
         line.highlight = value
 
     def get_filtered_indexes(self, force_remake_cache=False):
-        if not force_remake_cache:
-            try:
-                if self._last_filter == self._filter and self._last_values == self.values:
-                    return self._filtered_values_cache
-            except ReferenceError:
-                # Can happen if self.values was a list of weak references
-                pass
+        values_unchanged = self._values_unchanged(self._filter_cache_values, self._filter_cache_state)
+        if not force_remake_cache and self._last_filter == self._filter and values_unchanged:
+            return self._filtered_values_cache
         
+        last_filter = self._last_filter
         self._last_filter = self._filter
-        self._last_values = copy.copy(self.values)
+        self._filter_cache_values = self.values
+        self._filter_cache_state = self._values_state()
         if self._filter == None or self._filter == '':
-            return []
-        list_of_indexes = []
-        for indexer in range(len(self.values)):
-            if self.filter_value(indexer):
-                list_of_indexes.append(indexer)
+            list_of_indexes = []
+        elif type(self).filter_value is not MultiLine.filter_value:
+            # The subclass decides what matches, so every value has to be checked.
+            list_of_indexes = [indexer for indexer in range(len(self.values)) if self.filter_value(indexer)]
+        else:
+            display_strings = self._get_display_strings()
+            if values_unchanged and last_filter and last_filter in self._filter:
+                # Anything matching the longer filter also matched the previous one.
+                candidates = self._filtered_values_cache
+            else:
+                candidates = self._filter_candidates(display_strings)
+            list_of_indexes = [indexer for indexer in candidates if self._filter in display_strings[indexer]]
+        self._filtered_values_cache = list_of_indexes
         return list_of_indexes
     
+    def _get_display_strings(self):
+        # display_value of every value, kept until the values change.
+        if not self._values_unchanged(self._display_strings_values, self._display_strings_state):
+            self._display_strings = [self.display_value(vl) for vl in self.values]
+            self._display_strings_values = self.values
+            self._display_strings_state = self._values_state()
+            self._filter_index = None
+        return self._display_strings
+    
+    def _filter_candidates(self, display_strings):
+        if self.FILTER_INDEX_THRESHOLD is None or len(display_strings) < self.FILTER_INDEX_THRESHOLD:
+            return range(len(display_strings))
+        if self._filter_index is None:
+            self._filter_index = TrigramIndex(display_strings)
+        return self._filter_index.candidates(self._filter)
+    
     def get_filtered_values(self):
         fvls = []
         for vli in self.get_filtered_indexes():
@@ -650,6 +740,8 @@ class Pager(MultiLine):
         self.autowrap = autowrap
         self.center = center
         self._values_cache_for_wrapping = []
+        self._wrapped_values = None
+        self._wrapped_values_state = None
         
     def reset_display_cache(self):
         super(Pager, self).reset_display_cache()
@@ -685,13 +777,16 @@ class Pager(MultiLine):
             pass
         self.values = self._wrap_message_lines(lines, self.width-1)
         self._values_cache_for_wrapping = self.values
+        self._wrapped_values = self.values
+        self._wrapped_values_state = self._values_state()
     
     def centerValues(self):
         self.values  = [ l.strip().center(self.width-1) for l in self.values ]
     
     def update(self, clear=True):
         #we look this up a lot. Let's have it here.
-        if self.autowrap:
+        # Only wrap again if the values have changed since they were last wrapped.
+        if self.autowrap and not self._values_unchanged(self._wrapped_values, self._wrapped_values_state):
             self.setValuesWrap(list(self.values))
         
         if self.center:
@@ -721,7 +816,7 @@ class Pager(MultiLine):
         
         for w in self._my_widgets: 
             # call update to avoid needless refreshes
-            w.update(clear=True)
+            self._update_line(w, clear=True)
         # There is a bug somewhere that affects the first line.  This cures it.
         # Without this line, the first line inherits the color of the form when not editing. Not clear why.
         self._my_widgets[0].update()
@@ -799,6 +894,145 @@ class Pager(MultiLine):
         self.complex_handlers = [
                     ]
 
+class VirtualPager(Pager):
+    """A Pager for very long text.  Only the lines around the visible window are wrapped, 
+so the cost of a redraw depends on the height of the widget, not the length of the text.  
+Set the text with set_source, which accepts any sequence of lines (for example a memory mapped file)."""
+    WRAP_MARGIN = 20 # Wrapped lines kept either side of the window.
+    def __init__(self, screen, source=None, **keywords):
+        super(VirtualPager, self).__init__(screen, **keywords)
+        self._wrapped = collections.OrderedDict()
+        self.set_source(source if source is not None else [])
+    
+    def set_source(self, source):
+        "Display a new sequence of lines from the top.  The previous source is closed if it can be."
+        old = getattr(self, 'source', None)
+        if old is not None and old is not source and hasattr(old, 'close'):
+            old.close()
+        self.source = source
+        self.top_line = 0   # the source line at the top of the window
+        self.top_row  = 0   # how many of its wrapped rows are scrolled off
+        self._wrapped.clear()
+    
+    def reset_display_cache(self):
+        super(VirtualPager, self).reset_display_cache()
+        self._wrapped = collections.OrderedDict()
+    
+    def resize(self):
+        # Skip Pager.resize, which would wrap every value.
+        MultiLine.resize(self)
+    
+    def wrapped_line(self, line_no):
+        try:
+            return self._wrapped[line_no]
+        except KeyError:
+            pass
+        line = self.source[line_no]
+        if not self.autowrap:
+            rows = [line]
+        elif line.rstrip() == '':
+            rows = ['']
+        else:
+            rows = textwrap.wrap(line.rstrip(), self.width-1) or ['']
+        self._wrapped[line_no] = rows
+        return rows
+    
+    def _forget_wrapped(self, first, last):
+        # Only keep wrapped lines near the window.
+        for line_no in [l for l in self._wrapped if l < first or l > last]:
+            del self._wrapped[line_no]
+    
+    def move(self, rows):
+        "Scroll by a number of displayed (wrapped) rows, negative is up.  Returns the rows actually moved."
+        moved = 0
+        while rows > 0 and self.top_line < len(self.source):
+            if self.top_row + 1 < len(self.wrapped_line(self.top_line)):
+                self.top_row += 1
+            elif self.top_line + 1 < len(self.source):
+                self.top_line += 1
+                self.top_row = 0
+            else:
+                break
+            rows  -= 1
+            moved += 1
+        while rows < 0:
+            if self.top_row > 0:
+                self.top_row -= 1
+            elif self.top_line > 0:
+                self.top_line -= 1
+                self.top_row = len(self.wrapped_line(self.top_line)) - 1
+            else:
+                break
+            rows  += 1
+            moved -= 1
+        self.start_display_at = self.top_line
+        return moved
+    
+    def visible_rows(self, count):
+        "The next `count` rows from the top of the window and whether there is more text after them."
+        rows = []
+        line_no, skip = self.top_line, self.top_row
+        while len(rows) < count and line_no < len(self.source):
+            rows.extend(self.wrapped_line(line_no)[skip:])
+            line_no += 1
+            skip = 0
+        more = len(rows) > count or line_no < len(self.source)
+        self._forget_wrapped(self.top_line - self.WRAP_MARGIN, line_no + self.WRAP_MARGIN)
+        return rows[:count], more
+    
+    def update(self, clear=True):
+        if self.hidden:
+            if clear:
+                self.clear()
+            return False
+        display_length = len(self._my_widgets)
+        rows, more = self.visible_rows(display_length)
+        if more:
+            rows[-1] = MORE_LABEL
+        elif len(rows) < display_length and (self.top_line or self.top_row):
+            # Don't leave space at the bottom if there is text above the window.
+            self.move(len(rows) - display_length)
+            rows, more = self.visible_rows(display_length)
+        
+        for indexer, line in enumerate(self._my_widgets):
+            if indexer < len(rows):
+                line.value = self.display_value(rows[indexer])
+                line.hidden = False
+            else:
+                self._set_line_blank(line)
+            line.highlight = False
+            line.show_bold = False
+            self._update_line(line, clear=True)
+        # Same fix as in Pager.update for the color of the first line.
+        self._my_widgets[0].update()
+    
+    def h_scroll_line_up(self, input):
+        if not self.move(-1) and self.scroll_exit:
+            self.editing = False
+            self.how_exited = widget.EXITED_UP
+
+    def h_scroll_line_down(self, input):
+        rows, more = self.visible_rows(len(self._my_widgets))
+        if more:
+            self.move(1)
+        elif self.scroll_exit:
+            self.editing = False
+            self.how_exited = widget.EXITED_DOWN
+
+    def h_scroll_page_down(self, input):
+        self.move(len(self._my_widgets)-1)
+
+    def h_scroll_page_up(self, input):
+        self.move(-(len(self._my_widgets)-1))
+
+    def h_show_beginning(self, input):
+        self.top_line = self.top_row = self.start_display_at = 0
+    
+    def h_show_end(self, input):
+        self.top_line = max(len(self.source)-1, 0)
+        self.top_row  = max(len(self.wrapped_line(self.top_line))-1, 0) if self.source else 0
+        self.move(-(len(self._my_widgets)-1))
+
 class TitleMultiLine(titlefield.TitleText):
     _entry_type = MultiLine
 
@@ -837,6 +1071,7 @@ class BufferPager(Pager):
     
     def clearBuffer(self):
         self.values.clear()
+        self.values_changed()
     
     def setValuesWrap(self, lines):
         if self.autowrap and (lines == self._values_cache_for_wrapping):
@@ -849,10 +1084,13 @@ class BufferPager(Pager):
         self.clearBuffer()
         self.buffer(self._wrap_message_lines(lines, self.width-1))
         self._values_cache_for_wrapping = copy.deepcopy(self.values) 
+        self._wrapped_values = self.values
+        self._wrapped_values_state = self._values_state()
     
     def buffer(self, lines, scroll_end=True, scroll_if_editing=False):
         "Add data to be displayed in the buffer."
         self.values.extend(lines)
+        self.values_changed()
         if scroll_end:
             if not self.editing:
                 self.start_display_at = len(self.values) - len(self._my_widgets)
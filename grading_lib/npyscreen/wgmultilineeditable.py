@@ -54,6 +54,7 @@ class MultiLineEditable(wgmultiline.MultiLine):
         if self.cursor_line is None:
             self.cursor_line = 0
         self.values.insert(self.cursor_line, self.get_new_value())
+        self.values_changed()
         self.display()
         cont = self.edit_cursor_line_value()
         if cont and self.ALLOW_CONTINUE_EDITING:
@@ -62,6 +63,7 @@ class MultiLineEditable(wgmultiline.MultiLine):
     def delete_line_value(self):
         if len(self.values) > 0:
             del self.values[self.cursor_line]
+            self.values_changed()
             self.display()
     
     def _continue_editing(self):
@@ -70,6 +72,7 @@ class MultiLineEditable(wgmultiline.MultiLine):
         if hasattr(active_line, 'how_exited'):
             while active_line.how_exited == wgwidget.EXITED_DOWN and continue_editing:
                 self.values.insert(self.cursor_line+1, self.get_new_value())
+                self.values_changed()
                 self.cursor_line += 1
                 self.display()
                 continue_editing = self.edit_cursor_line_value()
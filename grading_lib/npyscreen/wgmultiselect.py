@@ -26,7 +26,7 @@ class MultiSelect(selectone.SelectOne):
             self.value.append(self.cursor_line)
     
     def h_set_filtered_to_selected(self, ch):
-        self.value = self._filtered_values_cache
+        self.value = list(self._filtered_values_cache)
     
     def h_select_exit(self, ch):
         if self.cursor_line >= 0 and not self.cursor_line in self.value:
@@ -6,6 +6,7 @@ import locale
 #import curses.wrapper
 from . import wgwidget as widget
 from . import npysGlobalOptions as GlobalOptions
+from . import npyspmfuncs as pmfuncs
 
 class TextfieldBase(widget.Widget):
     ENSURE_STRING_VALUE = True
@@ -210,58 +211,67 @@ class TextfieldBase(widget.Widget):
         else:
             return ch.encode('utf-8', 'strict')
     
+    def _print_unicode_string(self, string):
+        # The same as _print_unicode_char, for a whole run of characters.
+        if self._force_ascii:
+            return string.encode('ascii', 'replace')
+        elif sys.version_info[0] >= 3:
+            return string
+        else:
+            return string.encode('utf-8', 'strict')
+    
     def _get_string_to_print(self):
         string_to_print = self.display_value(self.value)
         if not string_to_print:
             return None
-        string_to_print = string_to_print[self.begin_at:self.maximum_string_length+self.begin_at-self.left_margin]
-        
-        if sys.version_info[0] >= 3:
-            string_to_print = self.display_value(self.value)[self.begin_at:self.maximum_string_length+self.begin_at-self.left_margin]
-        else:
+        if isinstance(string_to_print, bytes):
             # ensure unicode only here encoding here.
-            dv = self.display_value(self.value)
-            if isinstance(dv, bytes):
-                dv = dv.decode(self.encoding, 'replace')
-            string_to_print = dv[self.begin_at:self.maximum_string_length+self.begin_at-self.left_margin]
-        return string_to_print
+            string_to_print = string_to_print.decode(self.encoding, 'replace')
+        return string_to_print[self.begin_at:self.maximum_string_length+self.begin_at-self.left_margin]
+    
+    def _char_widths(self, string):
+        "The display width of each character in string."
+        if type(self).find_width_of_char is TextfieldBase.find_width_of_char:
+            return [1] * len(string)
+        return [self.find_width_of_char(ch) for ch in string]
     
+    def _fit_string(self, string):
+        """The number of characters of string that fit in the widget, and the columns 
+each of them starts at.  The last item in the list of columns is where the text ends."""
+        columns = [0]
+        for width in self._char_widths(string):
+            column = columns[-1]
+            if column > (self.maximum_string_length - self.left_margin) or \
+                    column - 1 + width > self.maximum_string_length:
+                break
+            columns.append(column + width)
+        return len(columns) - 1, columns
+    
+    def _highlight_at(self, place_in_string):
+        try:
+            return self._highlightingdata[self.begin_at+place_in_string]
+        except:
+            return curses.A_NORMAL
     
     def _print(self):
         string_to_print = self._get_string_to_print()
         if not string_to_print:
             return None
-        string_to_print = string_to_print[self.begin_at:self.maximum_string_length+self.begin_at-self.left_margin]
         
-        if sys.version_info[0] >= 3:
-            string_to_print = self.display_value(self.value)[self.begin_at:self.maximum_string_length+self.begin_at-self.left_margin]
-        else:
-            # ensure unicode only here encoding here.
-            dv = self.display_value(self.value)
-            if isinstance(dv, bytes):
-                dv = dv.decode(self.encoding, 'replace')
-            string_to_print = dv[self.begin_at:self.maximum_string_length+self.begin_at-self.left_margin]
-        
-        column = 0
-        place_in_string = 0
+        length, columns = self._fit_string(string_to_print)
         if self.syntax_highlighting:
             self.update_highlighting(start=self.begin_at, end=self.maximum_string_length+self.begin_at-self.left_margin)
-            while column <= (self.maximum_string_length - self.left_margin):
-                if not string_to_print or place_in_string > len(string_to_print)-1:
-                    break
-                width_of_char_to_print = self.find_width_of_char(string_to_print[place_in_string])
-                if column - 1 + width_of_char_to_print > self.maximum_string_length:
-                    break 
-                try:
-                    highlight = self._highlightingdata[self.begin_at+place_in_string]
-                except:
-                    highlight = curses.A_NORMAL                
-                self.parent.curses_pad.addstr(self.rely,self.relx+column+self.left_margin, 
-                    self._print_unicode_char(string_to_print[place_in_string]), 
-                    highlight
+            # Print each run of characters with the same highlighting in one go.
+            run_start = 0
+            for place_in_string in range(1, length + 1):
+                if place_in_string < length and \
+                        self._highlight_at(place_in_string) == self._highlight_at(run_start):
+                    continue
+                self.parent.curses_pad.addstr(self.rely,self.relx+columns[run_start]+self.left_margin, 
+                    self._print_unicode_string(string_to_print[run_start:place_in_string]), 
+                    self._highlight_at(run_start)
                     )
-                column += self.find_width_of_char(string_to_print[place_in_string])
-                place_in_string += 1
+                run_start = place_in_string
         else:
             if self.do_colors():
                 if self.show_bold and self.color == 'DEFAULT':
@@ -277,29 +287,16 @@ class TextfieldBase(widget.Widget):
                     color = curses.A_BOLD
                 else:
                     color = curses.A_NORMAL
-
-            while column <= (self.maximum_string_length - self.left_margin):
-                if not string_to_print or place_in_string > len(string_to_print)-1:
-                    if self.highlight_whole_widget:
-                        self.parent.curses_pad.addstr(self.rely,self.relx+column+self.left_margin, 
-                            ' ', 
-                            color
-                            )
-                        column += width_of_char_to_print
-                        place_in_string += 1
-                        continue
-                    else:
-                        break
-                        
-                width_of_char_to_print = self.find_width_of_char(string_to_print[place_in_string])
-                if column - 1 + width_of_char_to_print > self.maximum_string_length:
-                    break 
-                self.parent.curses_pad.addstr(self.rely,self.relx+column+self.left_margin, 
-                    self._print_unicode_char(string_to_print[place_in_string]), 
+            
+            text = string_to_print[:length]
+            if self.highlight_whole_widget:
+                # Pad to the end of the widget so the highlighting covers all of it.
+                text += ' ' * max(self.maximum_string_length - self.left_margin - columns[length] + 1, 0)
+            if text:
+                self.parent.curses_pad.addstr(self.rely,self.relx+self.left_margin, 
+                    self._print_unicode_string(text), 
                     color
                     )
-                column += width_of_char_to_print
-                place_in_string += 1
     
     
     
@@ -363,6 +360,7 @@ class Textfield(TextfieldBase):
         self.value = message
         self.editing=False
         self.display()
+        pmfuncs.flush_screen()
         curses.napms(1200)
         self.editing=True
         self.value = keep_for_a_moment
@@ -8,7 +8,9 @@ import curses.ascii
 import weakref
 from . import npysGlobalOptions as GlobalOptions
 from . import wgwidget_proto
+from . import npyspmfuncs as pmfuncs
 import locale
+import select
 import warnings
 
 from .globals import DEBUG
@@ -552,6 +554,27 @@ big a given widget is ... use .height and .width instead"""
                 self.parent.parentApp.adjust_widgets()
             
     
+    def _wait_for_key_or_event(self):
+        """Wait for a keypress, an application event or the keypress timeout.  Returns True if there is a key 
+        to read.  Applications without event queues just read the key as before."""
+        try:
+            wakeup = self.find_parent_app().event_wakeup_filenos()
+        except AttributeError:
+            return True
+        # curses may already have read keys that select can't see.
+        self.parent.curses_pad.nodelay(1)
+        ch = self.parent.curses_pad.getch()
+        self.parent.curses_pad.nodelay(0)
+        if ch != -1:
+            curses.ungetch(ch)
+            return True
+        if self.parent.keypress_timeout:
+            timeout = self.parent.keypress_timeout / 10.0
+        else:
+            timeout = None
+        ready = select.select([sys.stdin] + wakeup, [], [], timeout)[0]
+        return sys.stdin in ready
+    
     def try_while_waiting(self):
         if hasattr(self.parent, "while_waiting"):
             self.parent.while_waiting()
@@ -563,11 +586,15 @@ big a given widget is ... use .height and .width instead"""
 
     def get_and_use_key_press(self):
         global TEST_SETTINGS
+        # Show everything drawn since the last key in one update, then hold updates while this key is handled.
+        pmfuncs.flush_screen()
         if (TEST_SETTINGS['TEST_INPUT'] is None) and (TEST_SETTINGS['INPUT_GENERATOR'] is None):
             curses.raw()
             curses.cbreak()
             curses.meta(1)
             self.parent.curses_pad.keypad(1)
+            if not self._wait_for_key_or_event():
+                return self.try_while_waiting()
             if self.parent.keypress_timeout:
                 curses.halfdelay(self.parent.keypress_timeout)
                 ch = self._get_ch()
@@ -607,6 +634,7 @@ big a given widget is ... use .height and .width instead"""
                 else:
                     raise ExhaustedTestInput
         
+        pmfuncs.defer_screen_updates()
         self.handle_input(ch)
         if self.check_value_change:
             self.when_check_value_changed()
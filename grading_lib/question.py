@@ -1,10 +1,14 @@
-import json
-import os
+import queue
+import threading
 import time
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from multiprocessing.pool import ThreadPool
+from typing import Dict, Iterable, List, Optional
 
 from grading_lib import npyscreen
-from grading_lib.db.question import ReviewDB
+from grading_lib.db.question import ReviewDB, StudentReview, load_reviews
+from grading_lib.db.stats import ReviewStats
+from grading_lib.writeup import TextLines, WriteupStore
 
 log = open("log.log", "w")
 
@@ -56,6 +60,8 @@ class Writeup(object):
 
 class GradeDB(object):
     Row = namedtuple("Row", ["x500", "score", "msg"])
+    PREFETCH_SIZE = 8  # Number of prefetched writeup sections to keep around.
+    PREFETCH_THREADS = 2
 
     def __init__(self, questions, writeup_dir, root):
         self.questions = questions
@@ -63,10 +69,22 @@ class GradeDB(object):
         self.root = root
 
         self.students = []
-        self.grades = {}
+        self.records = {}  # x500 -> StudentReview
+        self.rows = {}  # x500 -> Row
+        self.positions = {}  # x500 -> index in students
         self.questions_by_name = {}
+        self.prefetched = OrderedDict()  # (x500, section index, writeup mtime) -> section
+        self._prefetching = set()  # keys of prefetched that are being loaded
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_pool = None
+        self.assignments = {}  # x500 -> reviewer
+        self.base_scores = {}  # x500 -> automatic grade, counted in the stats' totals
+        self._stats = None
+        # Held while the cached records and stats are changed, so concurrent saves keep them in step.
+        self._lock = threading.RLock()
 
         self.db = ReviewDB(root)
+        self.writeups = WriteupStore(writeup_dir)
         self.__load_or_init()
 
     def __load_or_init(self):
@@ -74,53 +92,256 @@ class GradeDB(object):
             self.questions_by_name[question.name] = question
 
         # Add any non added students
-        for writeup in sorted(os.listdir(self.writeup_dir)):
-            name = os.path.splitext(writeup)[0]
-            if name not in self.students:
+        added = set(self.students)
+        for name in self.writeups.names():
+            if name not in added:
                 self.students += [name]
+                added.add(name)
 
         self.students.sort()
+        self.positions = {name: i for i, name in enumerate(self.students)}
+        self.reload()
+
+    def reload(self):
+        """Reads every review record into the cache in a single pass."""
+        records = self.db.records
+        with self._lock:
+            self.records = records
+            self.rows = {}
+            self._stats = None
+
+    @property
+    def stats(self) -> ReviewStats:
+        """Review statistics, built from the cache on first use and then updated as grades are set."""
+        with self._lock:
+            if self._stats is None:
+                self._stats = ReviewStats([q.name for q in self.questions], self.students, self.records.values(),
+                                          self.base_scores)
+            return self._stats
+
+    def set_base_scores(self, base_scores: Dict[str, int]):
+        with self._lock:
+            self.base_scores = base_scores
+            self._stats = None
+
+    def _cache_record(self, rec: StudentReview) -> StudentReview:
+        """Caches a record unless the same or a newer version is already cached, returns the cached record."""
+        with self._lock:
+            old = self.records.get(rec.x500)
+            if old is not None and old.version >= rec.version:
+                return old
+            self.records[rec.x500] = rec
+            self.rows.pop(rec.x500, None)
+            if self._stats is not None:
+                self._stats.update(old, rec)
+            return rec
+
+    def next_student(self, x500, reviewer=None):
+        """The x500 after `x500` in the grading order (assigned to `reviewer` if given) or None if it is the last one."""
+        i = self.positions.get(x500)
+        if i is None:
+            return None
+        # Indexed rather than sliced so the usual case, the very next student, doesn't copy the rest of the list.
+        for j in range(i + 1, len(self.students)):
+            name = self.students[j]
+            if reviewer is None or self.reviewer_for(name) in (None, reviewer):
+                return name
+        return None
+
+    def previous_student(self, x500):
+        i = self.positions.get(x500)
+        if i is None or i == 0:
+            return None
+        return self.students[i - 1]
+
+    def get_record(self, x500) -> StudentReview:
+        rec = self.records.get(x500)
+        if rec is None:
+            rec = StudentReview(x500, {})
+        return rec
+
+    def is_reviewed(self, x500):
+        return x500 in self.records
+
+    def get_row(self, x500):
+        row = self.rows.get(x500)
+        if row is None:
+            row = self.rows[x500] = self.Row(x500, self.get_record(x500).score, self.get_msg_for(x500))
+        return row
 
     def get_rows(self):
-        return [self.Row(name, self.db.get(name).score, self.get_msg_for(name)) for name in self.students]
+        return [self.get_row(name) for name in self.students]
+
+    def query_rows(self, ungraded=False, min_score=None, max_score=None, search=None, sort="x500", reverse=False,
+                   reviewer=None):
+        """Filters and sorts the cached rows.
+
+        Args:
+            ungraded: Only students which haven't been reviewed yet.
+            min_score: Only rows scoring at least this.
+            max_score: Only rows scoring at most this.
+            search: Only rows whose x500 or message contain this (case insensitive).
+            sort: The Row field to sort by.
+            reverse: Sort descending.
+            reviewer: Only students assigned to this reviewer.
+        """
+        if search:
+            search = search.casefold()
+        rows = []
+        for name in self.students:
+            if ungraded and self.is_reviewed(name):
+                continue
+            if reviewer is not None and self.reviewer_for(name) not in (None, reviewer):
+                continue
+            row = self.get_row(name)
+            if min_score is not None and row.score < min_score:
+                continue
+            if max_score is not None and row.score > max_score:
+                continue
+            if search and search not in row.x500.casefold() and search not in row.msg.casefold():
+                continue
+            rows.append(row)
+        if sort != "x500" or reverse:
+            rows.sort(key=lambda row: getattr(row, sort), reverse=reverse)
+        return rows
 
     def get_grade(self, name: str, question: str) -> int:
-        return self.db.get(name).get(question)
+        return self.get_record(name).get(question)
+
+    def get_grades(self, x500):
+        rec = self.get_record(x500)
+        return {question.name: rec.get(question.name) for question in self.questions}
 
     def set_grade(self, x500, q_name, grade):
+        self.set_grades(x500, {q_name: grade})
+
+    def set_grades(self, x500, grades: Dict[str, int], expected_version=None) -> StudentReview:
+        """Saves a student's grades, see ReviewDB.update for how concurrent edits are handled."""
+        # Write through so the cache and the review db never disagree.
+        rec = self.db.update(x500, grades, expected_version)
+        self._cache_record(rec)
+        return rec
+
+    def merge(self, src):
+        """Merges in another reviewer's grades from a review directory or archive (see ReviewDB.merge)."""
+        changed = self.db.merge(load_reviews(src))
+        for rec in changed:
+            self._cache_record(rec)
+        return len(changed)
+
+    def save_as(self, path):
+        self.db.save_as(path)
+
+    def refresh(self, x500) -> StudentReview:
+        """Re-reads a student's record in case another reviewer saved it."""
         rec = self.db.get(x500)
-        rec.set(q_name, grade)
-        self.db.save(rec)
+        if not rec.version:
+            return rec  # Never saved.
+        # Compared with the cached version under the lock, so an older read can't replace a newer save.
+        return self._cache_record(rec)
+
+    def assign_reviewers(self, reviewers: List[str]):
+        """Splits the students into evenly sized blocks, one per reviewer, so reviewers don't grade the same student."""
+        self.assignments = {}
+        if not reviewers:
+            return
+        for i, name in enumerate(self.students):
+            self.assignments[name] = reviewers[i * len(reviewers) // len(self.students)]
+
+    def reviewer_for(self, x500) -> Optional[str]:
+        return self.assignments.get(x500)
+
+    def save(self):
+        """Grades are written as they are set, so there is nothing left to save."""
+        pass
 
     def get_msg_for(self, name):
+        rec = self.get_record(name)
         msgs = []
         for question in self.questions:
-            msgs += [question.get_msg(self.get_grade(name, question.name))]
+            msgs += [question.get_msg(rec.get(question.name))]
         return "  ".join(msgs)
 
     def get_text_for(self, value):
-        name = value
-        return open(os.path.join(self.writeup_dir, name + ".txt"), "rb").read().decode("utf-8", "ignore")
+        return self.writeups.text(value)
+
+    def get_writeup_lines(self, x500) -> TextLines:
+        """The writeup's plain text lines, read from disk as they are displayed."""
+        return self.writeups.lines(x500)
 
     def get_writeup(self, x500):
-        return json.load(open(os.path.join(self.writeup_dir, x500 + ".json"), "r"))
+        return self.writeups.sections(x500)
+
+    def get_writeup_index(self, x500):
+        return self.writeups.index(x500)
+
+    def get_writeup_mtime(self, x500):
+        return self.writeups.mtime(x500)
+
+    def get_writeup_section(self, x500, i):
+        # Keyed on the mtime so a regraded writeup is never served from an old prefetch.
+        with self._prefetch_lock:
+            section = self.prefetched.pop((x500, i, self.writeups.mtime(x500)), None)
+        if section is None:
+            section = self.writeups.section(x500, i)
+        return section
+
+    def prefetch_writeup(self, x500, sections: Iterable[int]=(0,)):
+        """Loads some of a writeup's sections in the background so they are ready when the grader opens them.
+
+        At most PREFETCH_SIZE sections are loading at once, further requests are dropped until they finish.
+        """
+        if x500 is None:
+            return
+        mtime = self.writeups.mtime(x500)
+        with self._prefetch_lock:
+            if self._prefetch_pool is None:
+                self._prefetch_pool = ThreadPool(self.PREFETCH_THREADS)
+            for i in sections:
+                key = (x500, i, mtime)
+                if key in self.prefetched or key in self._prefetching or \
+                        len(self._prefetching) >= self.PREFETCH_SIZE:
+                    continue
+                self._prefetching.add(key)
+                self._prefetch_pool.apply_async(self._prefetch_section, (key,))
+
+    def _prefetch_section(self, key):
+        x500, i, mtime = key
+        try:
+            section = self.writeups.section(x500, i)
+        except Exception:
+            section = None  # It is loaded again, and the error reported, if it is asked for.
+        with self._prefetch_lock:
+            self._prefetching.discard(key)
+            if section is not None:
+                self.prefetched[key] = section
+                while len(self.prefetched) > self.PREFETCH_SIZE:
+                    self.prefetched.popitem(last=False)
 
 
 class QuestionGrader(object):
-    def __init__(self, questions, writeup_dir, save_loc='data/review'):
+    def __init__(self, questions, writeup_dir, save_loc='data/review', base_scores: Dict[str, int]=None):
+        """`base_scores` are the students' automatic grades, added to their review scores in the stats' totals."""
         self.questions = questions
         self.writeup_dir = writeup_dir
         self.save_loc = save_loc
+        self.base_scores = base_scores
 
     def grade(self):
         """Returns True if finished grading otherwise False"""
         # for writeup in sorted(os.listdir(self.writeup_dir)):
         #     print(writeup)
-        self.gradedb = GradeDB(self.questions, self.writeup_dir, self.save_loc)
-        myApp = AddressBookApplication(self.gradedb)
+        myApp = AddressBookApplication(questions=self.questions, load_gradedb=self.load_gradedb)
         myApp.run()
+        self.gradedb = myApp.gradedb
         return False
 
+    def load_gradedb(self) -> GradeDB:
+        gradedb = GradeDB(self.questions, self.writeup_dir, self.save_loc)
+        if self.base_scores is not None:
+            gradedb.set_base_scores(self.base_scores)
+        return gradedb
+
     def load(self):
         raise DeprecationWarning("No need to call this.")
 
@@ -141,6 +362,13 @@ class RecordList(npyscreen.MultiLineAction):
         self.parent.parentApp.getForm('EDITRECORDFM').value = act_on_this[0]
         self.parent.parentApp.switchForm('EDITRECORDFM')
 
+    def when_cursor_moved(self):
+        # The highlighted student is the most likely to be opened next.
+        try:
+            self.parent.parentApp.request_writeup(self.values[self.cursor_line][0], slot="highlighted")
+        except IndexError:
+            pass
+
     # def when_merge(self, *args, **keywords):
     #     # notify_result = npyscreen.notify_ok_cancel("You want to merge?", title='popup')
     #     # npyscreen.notify("File: {}".format(the_selected_file), title='Merging')
@@ -167,14 +395,23 @@ class RecordListDisplay(npyscreen.FormBaseNew):
     FRAMED = False
 
     def create(self):
+        self.header = self.add(npyscreen.FixedText, value="", editable=False)
         self.list = self.add(RecordList, name="Test")
 
     def beforeEditing(self):
         self.update_list()
 
     def update_list(self):
-        self.list.values = self.parentApp.gradedb.get_rows()
-        self.list.display()
+        gradedb = self.parentApp.gradedb
+        if gradedb is None:
+            self.header.value = self.parentApp.load_error or "Loading reviews..."
+            self.list.values = []
+        else:
+            self.header.value = gradedb.stats.summary()
+            self.list.values = gradedb.get_rows()
+            if self.list.values:
+                self.parentApp.request_writeup(self.list.values[self.list.cursor_line][0], slot="highlighted")
+        self.display()
 
 
 class EditRecord(npyscreen.ActionForm):
@@ -185,14 +422,16 @@ class EditRecord(npyscreen.ActionForm):
             "^A": self.when_exit,
         })
         self.value = None
+        self.loading_writeup = False
         # self.questions = self.add(npyscreen.BoxBasic, name="Questions:", max_width=30, relx=2, max_height=3)
         # self.wgLastName = self.add(npyscreen.TitleText, name = "Last Name:",)
         self.questions = {}
-        for question in self.parentApp.gradedb.questions:
+        for question in self.parentApp.questions:
             self.questions[question.name] = self.add(TitleNumber, name="{}:".format(question.name), value="", total=str(question.points), relx=3, max_width=30)
 
         # self.writeup = self.add(npyscreen.Pager, name="Writeup", rely=2, relx=33)
-        self.writeup = self.add(npyscreen.Pager, name="Writeup", rely=2, relx=34, autowrap=True, exit_left=True, exit_right=True)
+        self.writeup = self.add(npyscreen.VirtualPager, name="Writeup", rely=2, relx=34, autowrap=True, exit_left=True,
+                                exit_right=True)
         # self.writeup.values = ["This is a test"]
         # self.writeup = self.add(npyscreen.BoxTitle, name="Writeup:", rely=2, relx=32)
         # self.wgOtherNames = self.add(npyscreen.TitleText, name = "Other Names:")
@@ -200,9 +439,9 @@ class EditRecord(npyscreen.ActionForm):
 
     def beforeEditing(self):
         if self.value:
-            record = self.parentApp.gradedb.get_text_for(self.value)
             self.name = "Grading for %s" % self.value
-            self.writeup.values = record.split("\n")
+            self.show_writeup()
+            self.parentApp.prefetch_writeups_after(self.value)
             for q_name in self.parentApp.gradedb.questions_by_name.keys():
                 grade = self.parentApp.gradedb.get_grade(self.value, q_name)
                 if grade == 0:
@@ -224,6 +463,22 @@ class EditRecord(npyscreen.ActionForm):
         #     self.wgOtherNames.value = ''
         #     self.wgEmail.value      = ''
 
+    def show_writeup(self):
+        """Shows the writeup if it has been loaded, otherwise asks for it and shows it when it arrives."""
+        lines = self.parentApp.take_writeup(self.value)
+        if lines is None:
+            self.writeup.set_source(["Loading writeup..."])
+            self.parentApp.request_writeup(self.value)
+        else:
+            self.writeup.set_source(lines)
+        self.loading_writeup = lines is None
+
+    def writeup_loaded(self, x500):
+        # Only draw if the form is on screen, otherwise the writeup is picked up by beforeEditing.
+        if self.editing and self.loading_writeup and self.value == x500:
+            self.show_writeup()
+            self.writeup.display()
+
     def when_save(self, *args, **keywords):
         self.on_ok()
 
@@ -233,8 +488,8 @@ class EditRecord(npyscreen.ActionForm):
 
     def on_ok(self):
         # grades = [int("0" + x.value) for x in self.questions]
-        for q_name, question in self.questions.items():
-            self.parentApp.gradedb.set_grade(self.value, q_name, int("0" + question.value))
+        self.parentApp.gradedb.set_grades(self.value, {q_name: int("0" + question.value)
+                                                       for q_name, question in self.questions.items()})
         # self.parentApp.gradedb.save()
 
         # if self.record_id: # We are editing an existing record
@@ -254,16 +509,129 @@ class EditRecord(npyscreen.ActionForm):
         self.parentApp.switchFormPrevious()
 
 
-class AddressBookApplication(npyscreen.NPSAppManaged):
-    def __init__(self, gradedb):
+class BackgroundLoader(object):
+    """Runs slow loads on a worker thread and hands each result back to the app as an event.
+
+    The event's payload is `(key, result)`, where result is the exception if the load failed.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.jobs = queue.Queue()
+        self.latest = {}  # slot -> the last job submitted to it
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def submit(self, event_name, key, func, *args, slot=None):
+        """Queues a load. A job submitted to a `slot` is dropped, with no event, if it is still waiting when another
+        job is submitted to the same slot, so a burst of requests only loads the last one."""
+        job = (event_name, key, func, args, slot)
+        if slot is not None:
+            with self._lock:
+                self.latest[slot] = job
+        self.jobs.put(job)
+
+    def _is_superseded(self, job):
+        with self._lock:
+            return job[4] is not None and self.latest.get(job[4]) is not job
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            event_name, key, func, args, slot = job
+            try:
+                if self._is_superseded(job):
+                    continue
+                try:
+                    result = func(*args)
+                except Exception as e:
+                    result = e
+                self.app.queue_event(npyscreen.Event(event_name, payload=(key, result)))
+            finally:
+                self.jobs.task_done()
+
+    def wait_until_idle(self):
+        """Blocks until every submitted load has finished and its event has been queued."""
+        self.jobs.join()
+
+
+class AddressBookApplication(npyscreen.StandardApp):
+    PREFETCH_WRITEUPS = 3  # Number of loaded writeups to keep ready.
+
+    def __init__(self, gradedb=None, load_gradedb=None, questions=None):
+        """Either pass a loaded `gradedb` or a `load_gradedb` function, which is called in the background."""
         super().__init__()
         self.gradedb = gradedb
+        self.load_gradedb = load_gradedb
+        self.questions = questions if questions is not None else gradedb.questions
+        self.load_error = None
+        self.writeups = OrderedDict()  # x500 -> loaded TextLines, only used on the UI thread
+        self.loading = set()  # x500s with a writeup load in progress
+        self.slots = {}  # slot -> the x500 last requested for it
+        self.loader = BackgroundLoader(self)
 
     def onStart(self):
         log.write("Starting")
+        self.add_event_hander("GRADEDB_LOADED", self.on_gradedb_loaded)
+        self.add_event_hander("WRITEUP_LOADED", self.on_writeup_loaded)
+        if self.gradedb is None:
+            self.loader.submit("GRADEDB_LOADED", None, self.load_gradedb)
         self.addForm("MAIN", RecordListDisplay)
         self.addForm("EDITRECORDFM", EditRecord)
 
+    def on_gradedb_loaded(self, event):
+        _, result = event.payload
+        if isinstance(result, Exception):
+            self.load_error = "Couldn't load reviews: {}".format(result)
+        else:
+            self.gradedb = result
+        self.getForm("MAIN").update_list()
+
+    def request_writeup(self, x500, slot=None):
+        """Starts loading a writeup in the background unless it is already loaded or loading.
+
+        Requests for the same `slot` replace each other (see BackgroundLoader.submit), e.g. only the student the
+        cursor stops on is loaded rather than every student it passes over.
+        """
+        if self.gradedb is None or x500 is None:
+            return
+        if slot is not None:
+            previous = self.slots.get(slot)
+            if previous != x500:
+                # Its load is dropped if it hasn't started, so it needs requesting again next time.
+                self.loading.discard(previous)
+            self.slots[slot] = x500
+        if x500 in self.writeups or x500 in self.loading:
+            return
+        self.loading.add(x500)
+        self.loader.submit("WRITEUP_LOADED", x500, self.gradedb.get_writeup_lines, x500, slot=slot)
+
+    def prefetch_writeups_after(self, x500, count=2):
+        for _ in range(count):
+            x500 = self.gradedb.next_student(x500)
+            self.request_writeup(x500)
+
+    def take_writeup(self, x500):
+        """The loaded writeup, or None if it isn't loaded yet. The caller is responsible for closing it."""
+        return self.writeups.pop(x500, None)
+
+    def on_writeup_loaded(self, event):
+        x500, lines = event.payload
+        self.loading.discard(x500)
+        if isinstance(lines, Exception):
+            lines = ["Couldn't load the writeup: {}".format(lines)]
+        if x500 in self.writeups:
+            # Loaded twice, e.g. requested again while a superseded load was already running. Keep the first.
+            if hasattr(lines, "close"):
+                lines.close()
+        else:
+            self.writeups[x500] = lines
+        while len(self.writeups) > self.PREFETCH_WRITEUPS:
+            _, old = self.writeups.popitem(last=False)
+            if hasattr(old, "close"):
+                old.close()
+        self.getForm("EDITRECORDFM").writeup_loaded(x500)
+
 
 class NumberEntry(npyscreen.Textfield):
     def __init__(self, screen, total=None, *args, **kwargs):
@@ -2,8 +2,11 @@ from __future__ import print_function
 import io
 import csv
 import json
+from bisect import bisect_left, insort
+from collections import namedtuple
+from collections.abc import MutableMapping
 from enum import Enum
-from typing import List, Dict, TextIO
+from typing import List, Dict, Iterable, Iterator, Optional, TextIO
 
 
 class Student(object):
@@ -66,17 +69,91 @@ class OutputFormat(Enum):
     CANVAS = 1
 
 
+EXPORT_FIELDS = {
+    OutputFormat.MOODLE: ['Id', 'Score', 'Comments'],
+    OutputFormat.CANVAS: ['Student Name', 'ID', 'SIS Login ID', 'Section', 'Score'],
+}
+
+
+def export_row(student: Student, format: OutputFormat) -> Dict[str, object]:
+    if format == OutputFormat.MOODLE:
+        return {"Id": "{}@umn.edu".format(student.x500),
+                "Score": student.score or 0,
+                "Comments": student.comment}
+    elif format == OutputFormat.CANVAS:
+        return {"Student Name": student.fname + " " + student.lname,
+                "ID": student.external_id,
+                "SIS Login ID": "{}@umn.edu".format(student.x500),
+                "Section": (student.extra_tags or {}).get("Section") or 1,
+                "Score": student.score or 0}
+    raise ValueError(f'Invalid format: {format}')
+
+
+def dump_students(students: Iterable[Student], outputs: Dict[OutputFormat, TextIO]):
+    """Writes the students to a csv file per format in a single pass over `students`."""
+    writers = {}
+    for format, f in outputs.items():
+        writers[format] = csv.DictWriter(f, EXPORT_FIELDS[format])
+        writers[format].writeheader()
+    for student in students:
+        for format, writer in writers.items():
+            writer.writerow(export_row(student, format))
+
+
+class SortedStudents(MutableMapping):
+    """A sid -> student mapping which iterates in x500 order.
+
+    The order is kept up to date on insert so iterating never needs to sort.
+    """
+    def __init__(self, students: Dict[str, Student]=None, on_change=None):
+        self._students = dict(students or {})
+        self._order = sorted(self._students)
+        self.on_change = on_change
+
+    def __getitem__(self, sid) -> Student:
+        return self._students[sid]
+
+    def __setitem__(self, sid, student: Student):
+        if sid not in self._students:
+            insort(self._order, sid)
+        self._students[sid] = student
+        if self.on_change:
+            self.on_change()
+
+    def __delitem__(self, sid):
+        del self._students[sid]
+        del self._order[bisect_left(self._order, sid)]
+        if self.on_change:
+            self.on_change()
+
+    def __contains__(self, sid):
+        return sid in self._students
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._order)
+
+    def __len__(self):
+        return len(self._students)
+
+    def __repr__(self):
+        return "SortedStudents({})".format(self._order)
+
+
+RosterIndexes = namedtuple('RosterIndexes', ['by_name', 'by_external_id', 'by_login', 'ambiguous_names'])
+
+
 class Roster(object):
-    students: Dict[str, Student]  # sid -> student
     groups: List[StudentGroup]
     group_submitters: Dict[Student, StudentGroup]
 
+    LOGIN_TAGS = {'email', 'sis login id', 'login'}  # extra_tags (lower case) which hold a login or email.
+
     def __init__(self, roster_path='../roster.csv'):
-        self.students = {}
         self.groups = []
         self.group_submitters = {}
 
         # read in students
+        students = {}
         with open(roster_path, 'r', newline='') as fp:
             roster_reader = csv.DictReader(fp)
             for row in roster_reader:
@@ -90,10 +167,70 @@ class Roster(object):
                 for key, value in row.items():
                     if key not in {'x500', 'first name', 'last name', 'id'}:
                         extra_tags[key] = value.strip()
-                self.students[sid] = Student(sid, fname, lname, external_id, extra_tags)
+                students[sid] = Student(sid, fname, lname, external_id, extra_tags)
+        self.students = students  # Sorted once here rather than on every insert.
+
+    @property
+    def students(self) -> SortedStudents:  # sid -> student
+        return self._students
+
+    @students.setter
+    def students(self, students: Dict[str, Student]):
+        self._students = SortedStudents(students, on_change=self._students_changed)
+        self._indexes = None
+
+    def _students_changed(self):
+        self._indexes = None
+
+    def __iter__(self) -> Iterator[Student]:
+        return iter(self.students.values())
+
+    def filter(self, done: Optional[bool]=None, section: Optional[str]=None, group: Optional[StudentGroup]=None,
+               section_tag='Section') -> Iterator[Student]:
+        """Lazily iterates over the students in x500 order which match every given criteria.
+
+        Args:
+            done: Only students whose `done` flag matches.
+            section: Only students whose `extra_tags[section_tag]` matches.
+            group: Only students in the group.
+            section_tag: The roster column holding the section.
+        """
+        members = None
+        if group is not None:
+            members = {student.x500 for student in group}
+        for student in self:
+            if done is not None and student.done != done:
+                continue
+            if section is not None and (student.extra_tags or {}).get(section_tag) != section:
+                continue
+            if members is not None and student.x500 not in members:
+                continue
+            yield student
+
+    @property
+    def indexes(self) -> RosterIndexes:
+        """Lookup indexes over the students, built on first use and rebuilt whenever `students` changes."""
+        if self._indexes is None:
+            self._indexes = self._build_indexes()
+        return self._indexes
+
+    def _build_indexes(self) -> RosterIndexes:
+        by_name = {}  # (fname, lname) case folded -> [sid]
+        by_external_id = {}
+        by_login = {}
+        for sid, student in self.students.items():
+            by_name.setdefault((student.fname.casefold(), student.lname.casefold()), []).append(sid)
+            if student.external_id:
+                by_external_id.setdefault(student.external_id, sid)
+            by_login.setdefault(sid.casefold(), sid)
+            for key, value in (student.extra_tags or {}).items():
+                if key.lower() in self.LOGIN_TAGS and value:
+                    by_login.setdefault(value.casefold(), sid)
 
-    def __iter__(self):
-        return iter(sorted(self.students.values(), key=lambda x: x.x500))
+        ambiguous_names = {name: sids for name, sids in by_name.items() if len(sids) > 1}
+        for (fname, lname), sids in ambiguous_names.items():
+            print("Warning: the name '{} {}' is ambiguous between {}".format(fname, lname, ", ".join(sids)))
+        return RosterIndexes(by_name, by_external_id, by_login, ambiguous_names)
 
     # def save_json(self, filepath):
     #     with open(filepath, 'wb') as fp:
@@ -103,24 +240,23 @@ class Roster(object):
     #         json.dump()
 
     def get_not_done(self):
-        return filter(lambda x: not x.done, self.students.values())
+        return self.filter(done=False)
 
-    def get_student_id_by_name(self, fname, lname, ignore_case=True):
-        for sid, student in self.students.items():
-            if ignore_case:
-                if student.fname.lower() == fname.lower() and student.lname.lower() == lname.lower():
-                    return sid
-            else:
-                if student.fname == fname and student.lname == lname:
-                    return sid
-        return None
-
-    def get_student_id_by_external_id(self, external_id):
-        for sid, student in self.students.items():
-            if student.external_id == external_id:
+    def get_student_id_by_name(self, fname, lname, ignore_case=True) -> Optional[str]:
+        sids = self.indexes.by_name.get((fname.casefold(), lname.casefold()), [])
+        for sid in sids:
+            student = self.students[sid]
+            if ignore_case or (student.fname == fname and student.lname == lname):
                 return sid
         return None
 
+    def get_student_id_by_external_id(self, external_id) -> Optional[str]:
+        return self.indexes.by_external_id.get(external_id)
+
+    def get_student_id_by_login(self, login) -> Optional[str]:
+        """Looks up a student by their x500 or by any email/login listed in the roster."""
+        return self.indexes.by_login.get(login.strip().casefold())
+
     def load_groups(self, filename: str):
         self.groups = []  # type: List[StudentGroup]
         with open(filename, "r") as fp:
@@ -142,28 +278,10 @@ class Roster(object):
             self.students[sid].comment = comments
 
     def dump_moodle(self, f):
-        writer = csv.DictWriter(f, ['Id', 'Score', 'Comments'])
-        writer.writeheader()
-        for student in sorted(self, key=lambda x: x.x500):
-            row = {"Id": "{}@umn.edu".format(student.x500),
-                   "Score": student.score,
-                   "Comments": student.comment}
-            if not student.score:
-                row["Score"] = 0
-            writer.writerow(row)
+        dump_students(self, {OutputFormat.MOODLE: f})
 
     def dump_canvas(self, f):
-        writer = csv.DictWriter(f, ['Student Name', 'ID', 'Section', 'Score'])
-        writer.writeheader()
-        for student in sorted(self, key=lambda x: x.x500):
-            row = {"Student Name": student.fname + " " + student.lname,
-                   "ID": student.external_id,
-                   "SIS Login ID": "{}@umn.edu".format(student.x500),
-                   "Section": 1,
-                   "Score": student.score}
-            if not student.score:
-                row["Score"] = 0
-            writer.writerow(row)
+        dump_students(self, {OutputFormat.CANVAS: f})
 
     def dump(self, f, format: OutputFormat = OutputFormat.MOODLE):
         if format == OutputFormat.MOODLE:
@@ -1,5 +1,13 @@
 import json
+import mmap
+import os
+import tempfile
+import zlib
+from array import array
+from bisect import bisect_right
 from enum import IntEnum
+from functools import lru_cache
+from typing import BinaryIO, Dict, List, TextIO
 
 
 class Priority(IntEnum):
@@ -15,26 +23,242 @@ class Writeup:
     def __init__(self, sections=None):
         if sections is None:
             sections = []
-        self.sections = [s.copy() for s in sections]
-        self.__sort()
+        # Sections are kept in priority order, ties keep the order they were added in.
+        self.sections = sorted(sections, key=lambda x: x['priority'])
+        self._priorities = [s['priority'] for s in self.sections]
 
     def __add__(self, other):
         return Writeup(self.sections + other.sections)
 
-    def __sort(self):
-        self.sections.sort(key=lambda x: x['priority'])
-
     def add_section(self, name, priority: Priority, text, html=None):
         if html is None:
             html = "<pre><code>{}</code></pre>".format(text)
-        self.sections += [{"name": name, "text": text, "html": html, 'priority': int(priority)}]
-        self.__sort()
+        i = bisect_right(self._priorities, int(priority))
+        self._priorities.insert(i, int(priority))
+        self.sections.insert(i, {"name": name, "text": text, "html": html, 'priority': int(priority)})
+
+    def dump_json(self, fp: TextIO):
+        """Writes the sections as a json list one section at a time."""
+        fp.write("[")
+        for i, section in enumerate(self.sections):
+            if i:
+                fp.write(", ")
+            json.dump(section, fp)
+        fp.write("]")
+
+    def dump_txt(self, fp: TextIO):
+        for i, section in enumerate(self.sections):
+            if i:
+                fp.write("\n\n")
+            fp.write("=== {}\n".format(section["name"]))
+            fp.write(section["text"])
 
-    def save(self, filename):
-        with open(filename + ".json", "w") as fp:
-            json.dump(self.sections, fp)
-        section_strs = []
+    def dump_compressed(self, fp: BinaryIO):
+        """Writes the writeup in the compressed format read by WriteupStore.
+
+        The first line is a json index of each section's name, priority and where its compressed text and html are.
+        The compressed blobs follow, offsets are relative to the end of the index line.
+        """
+        entries = []
+        blobs = []
+        offset = 0
         for section in self.sections:
-            section_strs += ["=== {}\n{}".format(section["name"], section["text"])]
-        with open(filename + ".txt", "w") as fp:
-            fp.write(bytes("\n\n".join(section_strs), encoding='utf8').decode('utf8', 'surrogateescape'))
+            entry = {"name": section["name"], "priority": section["priority"]}
+            for field in WriteupStore.FIELDS:
+                blob = zlib.compress(section[field].encode("utf-8", "surrogateescape"))
+                entry[field] = [offset, len(blob)]
+                offset += len(blob)
+                blobs.append(blob)
+            entries.append(entry)
+        fp.write(json.dumps({"codec": "zlib", "sections": entries}).encode("utf-8") + b"\n")
+        for blob in blobs:
+            fp.write(blob)
+
+    def save(self, filename, save_json=False, save_txt=True, save_compressed=True):
+        """Saves the writeup to `filename`.wup (compressed), `filename`.json and/or `filename`.txt
+
+        The .txt copy is kept by default so writeups can still be read without grading_lib, pass save_txt=False to
+        skip it.
+        """
+        if save_compressed:
+            with open(filename + WriteupStore.EXT, "wb") as fp:
+                self.dump_compressed(fp)
+        if save_json:
+            with open(filename + ".json", "w") as fp:
+                self.dump_json(fp)
+        if save_txt:
+            with open(filename + ".txt", "w") as fp:
+                self.dump_txt(fp)
+
+
+class WriteupStore:
+    """Reads the writeups in a directory, one section at a time when possible.
+
+    Compressed (.wup) writeups are preferred, otherwise the plain .json/.txt pair is read.
+    """
+    EXT = ".wup"
+    FIELDS = ("text", "html")
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def path(self, x500, ext=EXT):
+        return os.path.join(self.root_dir, x500 + ext)
+
+    def names(self) -> List[str]:
+        """The x500s which have a writeup, sorted."""
+        return sorted({os.path.splitext(file)[0] for file in os.listdir(self.root_dir)})
+
+    def is_compressed(self, x500) -> bool:
+        return os.path.exists(self.path(x500))
+
+    def mtime(self, x500) -> float:
+        """When the writeup was last written."""
+        if self.is_compressed(x500):
+            return os.path.getmtime(self.path(x500))
+        return os.path.getmtime(self.path(x500, ".json"))
+
+    def index(self, x500) -> List[Dict]:
+        """The name, priority and id of each section without loading the sections themselves."""
+        if self.is_compressed(x500):
+            sections = self._compressed_index(x500)["sections"]
+        else:
+            sections = self._json_sections(x500)
+        return [{"id": "section-{}".format(i), "name": s["name"], "priority": s["priority"]}
+                for i, s in enumerate(sections)]
+
+    def section(self, x500, i) -> Dict:
+        """Loads a single section, including its text and html."""
+        if not self.is_compressed(x500):
+            section = dict(self._json_sections(x500)[i])
+        else:
+            header = self._compressed_index(x500)
+            entry = header["sections"][i]
+            section = {"name": entry["name"], "priority": entry["priority"]}
+            with open(self.path(x500), "rb") as fp:
+                for field in self.FIELDS:
+                    offset, length = entry[field]
+                    fp.seek(header["data_start"] + offset)
+                    section[field] = zlib.decompress(fp.read(length)).decode("utf-8", "surrogateescape")
+        section["id"] = "section-{}".format(i)
+        return section
+
+    def sections(self, x500) -> List[Dict]:
+        if not self.is_compressed(x500):
+            # Parse the json once rather than once per section.
+            return [dict(s, id="section-{}".format(i)) for i, s in enumerate(self._json_sections(x500))]
+        return [self.section(x500, i) for i in range(len(self.index(x500)))]
+
+    def text(self, x500) -> str:
+        """The plain text version of the whole writeup."""
+        if not self.is_compressed(x500):
+            with open(self.path(x500, ".txt"), "rb") as fp:
+                return fp.read().decode("utf-8", "ignore")
+        return "\n\n".join("=== {}\n{}".format(s["name"], s["text"]) for s in self.sections(x500))
+
+    def open_text(self, x500) -> BinaryIO:
+        """Opens the plain text version of the writeup as a binary file.
+
+        The .txt copy is used if it is at least as new as the compressed writeup. Otherwise the compressed writeup is
+        decompressed a chunk at a time into a temporary file so the whole text is never held in memory.
+        """
+        txt_path = self.path(x500, ".txt")
+        if not self.is_compressed(x500) or self._txt_is_current(x500):
+            return open(txt_path, "rb")
+        header = self._compressed_index(x500)
+        out = tempfile.TemporaryFile()
+        with open(self.path(x500), "rb") as fp:
+            for i, entry in enumerate(header["sections"]):
+                if i:
+                    out.write(b"\n\n")
+                out.write("=== {}\n".format(entry["name"]).encode("utf-8", "surrogateescape"))
+                offset, length = entry["text"]
+                fp.seek(header["data_start"] + offset)
+                decompressor = zlib.decompressobj()
+                while length > 0:
+                    chunk = fp.read(min(length, self.CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    length -= len(chunk)
+                    out.write(decompressor.decompress(chunk))
+                out.write(decompressor.flush())
+        out.seek(0)
+        return out
+
+    def _txt_is_current(self, x500) -> bool:
+        try:
+            return os.path.getmtime(self.path(x500, ".txt")) >= os.path.getmtime(self.path(x500))
+        except OSError:
+            return False
+
+    def lines(self, x500) -> "TextLines":
+        """The lines of the plain text writeup, read from disk as they are needed."""
+        return TextLines(self.open_text(x500))
+
+    def _compressed_index(self, x500) -> Dict:
+        path = self.path(x500)
+        return _read_compressed_index(path, os.path.getmtime(path))
+
+    def _json_sections(self, x500) -> List[Dict]:
+        with open(self.path(x500, ".json"), "r") as fp:
+            return json.load(fp)
+
+
+@lru_cache(maxsize=256)
+def _read_compressed_index(path, mtime) -> Dict:
+    # Keyed on mtime so a regraded writeup is picked up.
+    with open(path, "rb") as fp:
+        line = fp.readline()
+    header = json.loads(line.decode("utf-8"))
+    assert header["codec"] == "zlib", "Unknown writeup codec: {}".format(header["codec"])
+    header["data_start"] = len(line)
+    return header
+
+
+class TextLines:
+    """A read only sequence of the lines in a text file, backed by a memory map of the file.
+
+    Only the offset of each line is kept in memory, lines are decoded when they are indexed.
+    """
+    def __init__(self, fp: BinaryIO, encoding="utf-8"):
+        self.fp = fp
+        self.encoding = encoding
+        try:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            self.data = b""
+        self.offsets = array("q", [0])  # offsets[i] is where line i starts
+        find = self.data.find
+        pos = find(b"\n")
+        while pos != -1:
+            self.offsets.append(pos + 1)
+            pos = find(b"\n", pos + 1)
+        if self.offsets[-1] == len(self.data) and len(self.offsets) > 1:
+            # A trailing newline doesn't start another line.
+            self.offsets.pop()
+
+    def __len__(self):
+        return len(self.offsets) if self.data else 0
+
+    def __getitem__(self, i) -> str:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("line index out of range")
+        end = self.offsets[i + 1] - 1 if i + 1 < len(self.offsets) else len(self.data)
+        return self.data[self.offsets[i]:end].decode(self.encoding, "replace").rstrip("\r\n")
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
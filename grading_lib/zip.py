@@ -1,10 +1,17 @@
 import os
+import shutil
 import tarfile
+import threading
+import time
 import zipfile
-from shutil import copyfile
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
+from typing import Dict, List, Optional
 
 from grading_lib import Roster
 
+EXTRACT_THREADS = os.cpu_count() or 1  # zlib releases the GIL so threads scale fine here.
+
 
 def ensure_dir_exists(dirpath):
     if not os.path.exists(dirpath):
@@ -16,99 +23,162 @@ def extract_zip(zippath, zipdir):
         zf.extractall(zipdir)
 
 
-def extract_moodle_zip(zippath, outpath, tmpdir, roster: Roster, internal_tarball=True):
-    zipdir = os.path.join(tmpdir, "zip")
-    extract_zip(zippath, zipdir)
-    ensure_dir_exists(outpath)
+def group_submissions(zf: zipfile.ZipFile) -> Dict[str, List[str]]:
+    """Groups the files in a submission archive by their top level entry (a directory or a single file)."""
+    groups = OrderedDict()
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        entry = info.filename.split("/", 1)[0]
+        groups.setdefault(entry, []).append(info.filename)
+    return groups
 
-    for subdir in os.listdir(zipdir):
-        name = subdir.split("_")[0]
-        parts = name.split(" ")
-        fname, lname = " ".join(parts[:-1]), parts[-1]
 
-        sid = roster.get_student_id_by_name(fname, lname)
+class IngestResult(namedtuple("IngestResult", ["x500", "members", "seconds", "error"])):
+    @property
+    def ok(self):
+        return self.error is None
 
-        if sid is None:
-            continue
-        # assert sid is not None, "Unknown student"
-
-        if internal_tarball:
-            # TODO: catch exceptions and give good error.
-            tarpath = os.path.join(zipdir, subdir)
-            if os.path.isdir(tarpath):
-                tarball_name = os.listdir(os.path.join(zipdir, subdir))[0]
-                tarpath = os.path.join(zipdir, subdir, tarball_name)
-
-#            if not tarpath.endswith(".tar.gz"):
-#                print("Student submission must be a tar.gz. filename was {}".format(tarpath))
-#                continue
-            sopath = os.path.join(outpath, sid)
-            try:
-                with tarfile.open(tarpath, mode="r:*") as tf:
-                    tf.extractall(sopath)
-            except tarfile.ReadError:
-                print("Submission was not a valid tarball.")
-            print(sid)
-        else:
-            submission_name = os.listdir(os.path.join(zipdir, subdir))[0]
-            submissionpath = os.path.join(zipdir, subdir, submission_name)
-
-            ext = ""
-            if "." in submission_name:
-                ext = submission_name[submission_name.index("."):]
-            new_path = os.path.join(outpath, sid + ext)
-
-            copyfile(submissionpath, new_path)
-
-
-def extract_canvas_zip(zippath, outpath, tmpdir, roster: Roster, internal_tarball=True):
-    zipdir = os.path.join(tmpdir, "zip")
-    extract_zip(zippath, zipdir)
+
+def extract_submissions(zippath, outpath, jobs: Dict[str, List[str]], internal_tarball=True,
+                        threads=EXTRACT_THREADS) -> List[IngestResult]:
+    """Extracts student submissions straight out of the archive into `outpath` without unpacking it first.
+
+    Args:
+        zippath: The path of the Moodle/Canvas archive.
+        outpath: The directory to put each student's submission in.
+        jobs: Maps each student's x500 to the archive members making up their submission.
+        internal_tarball: If True each submission is a tarball which is extracted to `outpath/<x500>`, otherwise the
+            submission is copied to `outpath/<x500><ext>`.
+        threads: The number of workers to extract with.
+
+    Returns:
+        An IngestResult per student. A failed student doesn't stop the others from being extracted.
+    """
     ensure_dir_exists(outpath)
 
-    for file in os.listdir(zipdir):
-        zipdir = os.path.join(tmpdir, "zip")
-        extract_zip(zippath, zipdir)
-        ensure_dir_exists(outpath)
+    # ZipFile handles can't be shared between threads so each worker opens its own.
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def archive() -> zipfile.ZipFile:
+        if not hasattr(local, "zf"):
+            local.zf = zipfile.ZipFile(zippath)
+            with handles_lock:
+                handles.append(local.zf)
+        return local.zf
+
+    def extract(job):
+        sid, members = job
+        start = time.perf_counter()
+        error = None
+        try:
+            for member in members:
+                if internal_tarball:
+                    extract_tarball_member(archive(), member, os.path.join(outpath, sid))
+                else:
+                    copy_member(archive(), member, outpath, sid)
+        except Exception as e:
+            error = "{}: {}".format(e.__class__.__name__, e)
+        return IngestResult(sid, members, time.perf_counter() - start, error)
+
+    try:
+        with ThreadPool(threads) as pool:
+            return pool.map(extract, jobs.items())
+    finally:
+        for zf in handles:
+            zf.close()
+
+
+def print_ingest_report(results: List[IngestResult], slowest=5):
+    failed = [r for r in results if not r.ok]
+    total = sum(r.seconds for r in results)
+    print("Ingested {} submission(s) in {:.2f}s of worker time, {} failed.".format(len(results), total, len(failed)))
+    for r in sorted(results, key=lambda r: r.seconds, reverse=True)[:slowest]:
+        print("\t{}: {:.3f}s".format(r.x500, r.seconds))
+    for r in failed:
+        print("\tFAILED {} ({}): {}".format(r.x500, ", ".join(r.members), r.error))
+
+
+def extract_tarball_member(zf: zipfile.ZipFile, member: str, sopath: str):
+    with zf.open(member) as stream:
+        try:
+            with tarfile.open(fileobj=stream, mode="r|*") as tf:
+                tf.extractall(sopath)
+        except tarfile.ReadError as e:
+            raise tarfile.ReadError("Submission was not a valid tarball ({})".format(e))
+
+
+def copy_member(zf: zipfile.ZipFile, member: str, outpath: str, sid: str):
+    submission_name = os.path.basename(member)
+    ext = ""
+    if "." in submission_name:
+        ext = submission_name[submission_name.index("."):]
+    new_path = os.path.join(outpath, sid + ext)
+
+    with zf.open(member) as src, open(new_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+
+def extract_moodle_zip(zippath, outpath, tmpdir, roster: Roster, internal_tarball=True) -> List[IngestResult]:
+    """Extracts a Moodle submission archive. `tmpdir` is no longer used since nothing is staged on disk."""
+    jobs = OrderedDict()  # x500 -> member names
+    with zipfile.ZipFile(zippath) as zf:
+        for entry, members in group_submissions(zf).items():
+            name = entry.split("_")[0]
+            parts = name.split(" ")
+            fname, lname = " ".join(parts[:-1]), parts[-1]
 
-        for subdir in os.listdir(zipdir):
-            # ext_id from canvas is listed second if not late, otherwise listed third
-            # either fnamelname_extid_whatever or fnamelname_LATE_extid_whatever
-            if "LATE" in subdir:
-                ext_id = subdir.split("_")[2]
-            else:
-                ext_id = subdir.split("_")[1]
+            sid = roster.get_student_id_by_name(fname, lname)
+            if sid is None:
+                continue
+            # Only the first file of a submission directory is the submission.
+            jobs.setdefault(sid, []).append(members[0])
 
-            sid = roster.get_student_id_by_external_id(ext_id)
+    results = extract_submissions(zippath, outpath, jobs, internal_tarball)
+    print_ingest_report(results)
+    return results
 
+
+def canvas_external_id(filename: str) -> Optional[str]:
+    """Returns the external ID from a Canvas submission filename.
+
+    The ext_id is listed second if not late, otherwise listed third:
+    either fnamelname_extid_whatever or fnamelname_LATE_extid_whatever
+    """
+    parts = filename.split("_")
+    if len(parts) > 2 and parts[1] == "LATE":
+        return parts[2]
+    if len(parts) > 1:
+        return parts[1]
+    return None
+
+
+def index_canvas_zip(zf: zipfile.ZipFile) -> Dict[str, str]:
+    """Builds an index of submission filename -> external ID for every parsable entry of a Canvas archive."""
+    index = OrderedDict()
+    for entry, members in group_submissions(zf).items():
+        ext_id = canvas_external_id(entry)
+        if ext_id is not None:
+            # Only the first file of a submission directory is the submission, the same as for Moodle.
+            index[members[0]] = ext_id
+    return index
+
+
+def extract_canvas_zip(zippath, outpath, tmpdir, roster: Roster, internal_tarball=True) -> List[IngestResult]:
+    """Extracts a Canvas submission archive. `tmpdir` is no longer used since nothing is staged on disk.
+
+    The archive is read once and each student's files are extracted exactly once.
+    """
+    jobs = OrderedDict()  # x500 -> member names
+    with zipfile.ZipFile(zippath) as zf:
+        for member, ext_id in index_canvas_zip(zf).items():
+            sid = roster.get_student_id_by_external_id(ext_id)
             if sid is None:
                 continue
-            # assert sid is not None, "Unknown student"
-
-            if internal_tarball:
-                # TODO: catch exceptions and give good error.
-                tarpath = os.path.join(zipdir, subdir)
-                if os.path.isdir(tarpath):
-                    tarball_name = os.listdir(os.path.join(zipdir, subdir))[0]
-                    tarpath = os.path.join(zipdir, subdir, tarball_name)
-
-                #            if not tarpath.endswith(".tar.gz"):
-                #                print("Student submission must be a tar.gz. filename was {}".format(tarpath))
-                #                continue
-                sopath = os.path.join(outpath, sid)
-                try:
-                    with tarfile.open(tarpath, mode="r:*") as tf:
-                        tf.extractall(sopath)
-                except tarfile.ReadError:
-                    print("Submission was not a valid tarball.")
-                print(sid)
-            else:
-                submission_name = os.listdir(os.path.join(zipdir, subdir))[0]
-                submissionpath = os.path.join(zipdir, subdir, submission_name)
-
-                ext = ""
-                if "." in submission_name:
-                    ext = submission_name[submission_name.index("."):]
-                new_path = os.path.join(outpath, sid + ext)
-
-                copyfile(submissionpath, new_path)
+            jobs.setdefault(sid, []).append(member)
+
+    results = extract_submissions(zippath, outpath, jobs, internal_tarball)
+    print_ingest_report(results)
+    return results
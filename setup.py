@@ -9,7 +9,7 @@ setup(
     author='Jonathan Beaulieu',
     author_email='123.jonathan@gmail.com',
     license='MIT',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     package_data={
         'grading_lib.interface.web': [
             'static/*',